@@ -0,0 +1,140 @@
+import time
+from typing import Dict, List, Optional
+
+import anthropic
+
+# Weight of the newest observation in a region's moving averages.
+EWMA_ALPHA = 0.2
+# Latency assumed for a region that has not answered yet, so each gets tried.
+INITIAL_LATENCY_SECONDS = 1.0
+MAX_COOLDOWN_SECONDS = 60.0
+
+
+def is_region_error(error: Exception) -> bool:
+    """Whether an error says more about the region than about the request.
+
+    Connection failures and every 5xx status, including 529 overloaded
+    (which the SDK does not raise as an InternalServerError), qualify.
+    """
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+    return isinstance(error, anthropic.APIStatusError) and error.status_code >= 500
+
+
+class Region:
+    """One region's client, with the latency and throttle rate observed from it."""
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.latency = INITIAL_LATENCY_SECONDS
+        self.throttle_rate = 0.0
+        self.in_flight = 0
+        self.calls = 0
+        self.throttles = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def score(self) -> float:
+        """Expected cost of sending the next call here; lower is better."""
+        return self.latency * (1 + self.in_flight) / max(0.05, 1 - self.throttle_rate)
+
+    def record(self, latency: Optional[float], throttled: bool, failed: bool) -> None:
+        self.calls += 1
+        if latency is not None:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+        self.throttle_rate += EWMA_ALPHA * (float(throttled) - self.throttle_rate)
+        self.throttles += throttled
+        if failed:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.cooldown_until = time.monotonic() + min(MAX_COOLDOWN_SECONDS, 2 ** self.consecutive_errors)
+        else:
+            self.consecutive_errors = 0
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            'latency_seconds': round(self.latency, 3),
+            'throttle_rate': round(self.throttle_rate, 3),
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'throttles': self.throttles,
+            'errors': self.errors,
+            'cooling_down': not self.available(now),
+        }
+
+
+class BedrockPool:
+    """Bedrock clients in several regions, each call routed to the least loaded one.
+
+    Regions are ranked by observed latency, in-flight calls and throttle
+    rate. A call that is throttled, or fails with a connection error or a
+    5xx status, is retried in the next region; a region that errors is skipped
+    for an exponentially growing cooldown. Only when every region throttled
+    the call is the RateLimitError raised, so the scan's retry queue and
+    AIMD window see account-wide throttling and nothing else.
+    """
+
+    def __init__(self, clients: Dict[str, object]):
+        if not clients:
+            raise ValueError("BedrockPool needs at least one region")
+        self.regions = [Region(name, client) for name, client in clients.items()]
+
+    def ranked(self) -> List[Region]:
+        now = time.monotonic()
+        return sorted(self.regions, key=lambda region: (not region.available(now), region.score()))
+
+    async def create(self, **kwargs):
+        """messages.create in the best region, failing over to the others."""
+        return await self._route(lambda client: client.messages.create(**kwargs))
+
+    async def stream(self, on_event, **kwargs):
+        """messages.stream in the best region, passing each stream event to on_event.
+
+        Returns the final message. A region that fails mid-stream is failed
+        over like any other, so on_event may see the start of a response
+        more than once.
+        """
+        async def streamed(client):
+            async with client.messages.stream(**kwargs) as stream:
+                async for event in stream:
+                    on_event(event)
+                return await stream.get_final_message()
+
+        return await self._route(streamed)
+
+    async def _route(self, call):
+        throttled_error = None
+        region_error = None
+        for region in self.ranked():
+            region.in_flight += 1
+            started = time.monotonic()
+            try:
+                response = await call(region.client)
+            except anthropic.RateLimitError as e:
+                region.record(None, throttled=True, failed=False)
+                throttled_error = e
+                continue
+            except (anthropic.APIConnectionError, anthropic.APIStatusError) as e:
+                if not is_region_error(e):
+                    raise
+                region.record(None, throttled=False, failed=True)
+                region_error = e
+                continue
+            finally:
+                region.in_flight -= 1
+            region.record(time.monotonic() - started, throttled=False, failed=False)
+            return response
+        raise throttled_error or region_error
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {region.name: region.snapshot(now) for region in self.regions}
+
+    async def close(self) -> None:
+        for region in self.regions:
+            await region.client.close()
@@ -0,0 +1,48 @@
+from typing import List, NamedTuple
+
+# Rough characters-per-token ratio for source code, used for budgeting only.
+CHARS_PER_TOKEN = 4
+
+
+class Window(NamedTuple):
+    """A line-aligned slice of a file; line numbers are 1-based and inclusive.
+
+    Only focus_start..focus_end is to be reported on. The overlap lines
+    around it are included as context, so findings near a boundary are
+    still seen in full by exactly one window.
+    """
+    focus_start: int
+    focus_end: int
+    text: str
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_into_windows(content: str, max_tokens: int, overlap_lines: int) -> List[Window]:
+    """Split content into windows of about max_tokens each, plus overlap_lines of context per side.
+
+    Every line of the window text is prefixed with its line number in the
+    original file, so the model reports original line numbers directly.
+    """
+    lines = content.splitlines()
+    windows = []
+    start = 0
+    while start < len(lines):
+        end = start
+        budget = max_tokens
+        # Always take at least one line, even if it alone exceeds the budget.
+        while end < len(lines) and (end == start or estimate_tokens(lines[end]) <= budget):
+            budget -= estimate_tokens(lines[end])
+            end += 1
+
+        context_start = max(0, start - overlap_lines)
+        context_end = min(len(lines), end + overlap_lines)
+        width = len(str(context_end))
+        text = '\n'.join(
+            f'{number + 1:>{width}}| {lines[number]}' for number in range(context_start, context_end)
+        )
+        windows.append(Window(start + 1, end, text))
+        start = end
+    return windows
@@ -0,0 +1,375 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional, Tuple
+
+# How often a call waiting on a shared bucket re-reads it; tokens given back by
+# other worker processes are only noticed by polling.
+SHARED_BUCKET_POLL_SECONDS = 0.5
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight model calls, shared by every scan in the process.
+
+    The window grows by about one slot for each window's worth of successful
+    calls and is cut multiplicatively whenever Bedrock throttles a request,
+    so the process settles just under the account's RPM/TPM ceiling.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease_factor: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.decrease_factor = decrease_factor
+        self._window = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.throttle_count = 0
+        self._epoch = 0
+        self._waiters = deque()
+
+    @property
+    def window(self) -> int:
+        return max(self.minimum, int(self._window))
+
+    async def acquire(self) -> int:
+        """Wait for a free slot and return the epoch the call was admitted in."""
+        if not self._waiters and self.in_flight < self.window:
+            self.in_flight += 1
+            return self._epoch
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # A slot was handed over just as we were cancelled; give it back.
+                self.in_flight -= 1
+                self._wake_waiters()
+            raise
+        return self._epoch
+
+    def release(self, epoch: int, throttled: bool = False) -> None:
+        self.in_flight -= 1
+        if throttled:
+            self.throttle_count += 1
+            # Calls admitted before the last cut were sized for the old window,
+            # so a burst of throttles from them only shrinks the window once.
+            if epoch == self._epoch:
+                self._window = max(self.minimum, self._window * self.decrease_factor)
+                self._epoch += 1
+        else:
+            self._window = min(self.maximum, self._window + 1 / self._window)
+        self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < self.window:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def snapshot(self) -> dict:
+        return {
+            'window': self.window,
+            'in_flight': self.in_flight,
+            'waiting': len(self._waiters),
+            'throttle_count': self.throttle_count,
+        }
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Return the server's retry hint in seconds, if it sent a usable one."""
+    if headers is None:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryQueue:
+    """Items waiting to be retried, released once their backoff has elapsed.
+
+    Delays use exponential backoff with equal jitter; a server retry-after
+    hint is treated as a lower bound.
+    """
+
+    def __init__(self, base_delay: float, max_delay: float):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, item, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Queue item after its attempt-th failure and return the chosen delay."""
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._sequence), item))
+        return delay
+
+    def pop_due(self):
+        """Return the next item whose delay has elapsed, or None."""
+        if self._heap and self._heap[0][0] <= time.monotonic():
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    def seconds_until_due(self) -> Optional[float]:
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+
+class TokenBucket:
+    """Tokens-per-minute budget for one model, shared by every call in the process.
+
+    A call reserves its estimated input tokens plus its output limit before
+    it is sent, waiting until the bucket holds that many, and settles the
+    reservation against the usage the API reports afterwards. Unused tokens
+    go back to the bucket; an overrun is taken out of it. Waiters are served
+    in arrival order.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._rate = tokens_per_minute / 60
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._turn = asyncio.Lock()
+        self._settled = asyncio.Event()
+        self.waiting = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int) -> int:
+        """Wait until tokens can be reserved and return the reservation to settle later."""
+        # A request larger than a whole minute's budget waits for a full bucket.
+        tokens = min(tokens, self.tokens_per_minute)
+        self.waiting += 1
+        try:
+            async with self._turn:
+                while True:
+                    self._refill()
+                    if self._tokens >= tokens:
+                        self._tokens -= tokens
+                        return tokens
+                    # Wait for the refill, or for a settled call to give tokens back.
+                    self._settled.clear()
+                    try:
+                        await asyncio.wait_for(self._settled.wait(), (tokens - self._tokens) / self._rate)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting -= 1
+
+    async def settle(self, reserved: int, used: int) -> None:
+        self._refill()
+        self._tokens = min(self.tokens_per_minute, self._tokens + reserved - used)
+        self._settled.set()
+
+    async def snapshot(self) -> dict:
+        self._refill()
+        return {
+            'tokens_per_minute': self.tokens_per_minute,
+            'available': int(self._tokens),
+            'waiting': self.waiting,
+        }
+
+
+class SharedBudgetStore:
+    """SQLite file holding the balance of token buckets shared by every worker process.
+
+    uvicorn workers each run their own event loop, so an in-process bucket
+    only limits one of them. Every take and refund here is a single
+    IMMEDIATE transaction against the file, so all processes on the host
+    draw from one balance per bucket.
+    """
+
+    def __init__(self, path: str):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS token_buckets ('
+            ' name TEXT PRIMARY KEY,'
+            ' tokens REAL NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ') WITHOUT ROWID'
+        )
+
+    def adjust(self, name: str, capacity: int, amount: float, require: bool = True) -> Tuple[bool, float]:
+        """Refill the bucket, then add amount (negative to take) to it.
+
+        With require, a change that would leave the balance negative is not
+        made. Returns whether the change was made and the resulting balance.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                tokens = self._refilled(name, capacity)
+                changed = not require or tokens + amount >= 0
+                if changed:
+                    tokens = min(capacity, tokens + amount)
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)',
+                    (name, tokens, time.time()),
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return changed, tokens
+
+    def balance(self, name: str, capacity: int) -> float:
+        with self._lock:
+            return self._refilled(name, capacity)
+
+    def _refilled(self, name: str, capacity: int) -> float:
+        row = self._conn.execute(
+            'SELECT tokens, updated_at FROM token_buckets WHERE name = ?', (name,),
+        ).fetchone()
+        if row is None:
+            return float(capacity)
+        tokens, updated_at = row
+        return min(capacity, tokens + max(0.0, time.time() - updated_at) * capacity / 60)
+
+
+class SharedTokenBucket:
+    """TokenBucket whose balance lives in a SharedBudgetStore, so it is shared across processes.
+
+    Waiters within a process are still served in arrival order; between
+    processes, whoever finds enough tokens first takes them.
+    """
+
+    def __init__(self, store: SharedBudgetStore, name: str, tokens_per_minute: int):
+        self.store = store
+        self.name = name
+        self.tokens_per_minute = tokens_per_minute
+        self._rate = tokens_per_minute / 60
+        self._turn = asyncio.Lock()
+        self._settled = asyncio.Event()
+        self.waiting = 0
+
+    async def acquire(self, tokens: int) -> int:
+        """Wait until tokens can be reserved and return the reservation to settle later."""
+        tokens = min(tokens, self.tokens_per_minute)
+        self.waiting += 1
+        try:
+            async with self._turn:
+                while True:
+                    taken, available = await asyncio.to_thread(
+                        self.store.adjust, self.name, self.tokens_per_minute, -tokens,
+                    )
+                    if taken:
+                        return tokens
+                    self._settled.clear()
+                    try:
+                        await asyncio.wait_for(
+                            self._settled.wait(),
+                            min((tokens - available) / self._rate, SHARED_BUCKET_POLL_SECONDS),
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting -= 1
+
+    async def settle(self, reserved: int, used: int) -> None:
+        # Off the event loop: the transaction may wait on other processes.
+        if reserved != used:
+            await asyncio.to_thread(
+                self.store.adjust, self.name, self.tokens_per_minute, reserved - used, require=False,
+            )
+        self._settled.set()
+
+    async def snapshot(self) -> dict:
+        available = await asyncio.to_thread(self.store.balance, self.name, self.tokens_per_minute)
+        return {
+            'tokens_per_minute': self.tokens_per_minute,
+            'available': int(available),
+            'waiting': self.waiting,
+            'shared': True,
+        }
+
+
+class TokenBudgets:
+    """Per-model token and request buckets; models without a configured limit are not limited.
+
+    Request budgets are buckets of one token per call that are never given
+    back. With a store, every bucket is shared with the other worker
+    processes using that store.
+    """
+
+    def __init__(self, default_tokens_per_minute: int, tokens_per_minute_by_model: dict,
+                 requests_per_minute: int = 0, store: Optional[SharedBudgetStore] = None):
+        self.default_tokens_per_minute = default_tokens_per_minute
+        self.tokens_per_minute_by_model = tokens_per_minute_by_model
+        self.requests_per_minute = requests_per_minute
+        self.store = store
+        self._buckets = {}
+
+    def bucket(self, model_id: str):
+        """Return the model's tokens-per-minute bucket, or None if it is not limited."""
+        return self._bucket(model_id, self.tokens_per_minute_by_model.get(model_id, self.default_tokens_per_minute))
+
+    def requests(self, model_id: str):
+        """Return the model's requests-per-minute bucket, or None if it is not limited."""
+        return self._bucket(f'{model_id} requests', self.requests_per_minute)
+
+    def _bucket(self, name: str, limit: int):
+        if name not in self._buckets:
+            if limit <= 0:
+                self._buckets[name] = None
+            elif self.store:
+                self._buckets[name] = SharedTokenBucket(self.store, name, limit)
+            else:
+                self._buckets[name] = TokenBucket(limit)
+        return self._buckets[name]
+
+    async def snapshot(self) -> dict:
+        return {name: await bucket.snapshot() for name, bucket in list(self._buckets.items()) if bucket}
+
+
+def parse_model_limits(value: str) -> dict:
+    """Parse "model-a=400000,model-b=200000" into {model_id: limit}."""
+    limits = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        model_id, separator, limit = entry.rpartition('=')
+        if not separator or not model_id.strip():
+            raise ValueError(f"Expected model_id=limit, got {entry.strip()!r}")
+        limits[model_id.strip()] = int(limit)
+    return limits
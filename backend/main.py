@@ -1,21 +1,33 @@
 import os
-import shutil
-import tempfile
 import json
+import time
 import asyncio
+from contextlib import ExitStack, aclosing, asynccontextmanager
 from pathlib import Path
-from typing import Optional
+from typing import List, Literal, NamedTuple, Optional, Tuple
 from urllib.parse import urlparse, urlunparse
 
 import anthropic
-from anthropic import AnthropicBedrockMantle
-from fastapi import FastAPI
+import httpx2
+from anthropic import AsyncAnthropicBedrockMantle
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from git import Repo
 from dotenv import load_dotenv
 
+from chunking import estimate_tokens, split_into_windows
+from bedrock_pool import BedrockPool
+from concurrency import (
+    AdaptiveConcurrency, RetryQueue, SharedBudgetStore, TokenBudgets, parse_model_limits, parse_retry_after,
+)
+from repo_mirrors import MirrorCache
+from result_cache import AnalysisCache, sha256_text
+from scan_jobs import ScanJobs, ScanJobStore
+from singleflight import ScanFlights
+from triage import path_priority, triage
+
 # Load environment variables from .env file
 env_path = Path(__file__).parent / '.env'
 load_dotenv(dotenv_path=env_path)
@@ -27,8 +39,96 @@ if not AWS_REGION:
 # AWS access keys are optional: boto3's default credential chain
 # (env vars, ~/.aws/credentials, IAM role) is used when they are not set.
 MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-sonnet-5")
+# Optional cheaper model that screens files first; only files it flags as
+# suspicious are analyzed by MODEL_ID. Empty sends every file to MODEL_ID.
+SCREENING_MODEL_ID = os.getenv("BEDROCK_SCREENING_MODEL_ID", "")
+SCREENING_MAX_TOKENS = int(os.getenv("SCREENING_MAX_TOKENS", "256"))
+# Stream analysis responses and send each finding as a 'finding' event as soon
+# as the model has written it, before the file's result is complete.
+STREAM_FINDINGS = os.getenv("STREAM_FINDINGS", "false").lower() == "true"
 MAX_FILE_SIZE_BYTES = int(os.getenv("MAX_FILE_SIZE_BYTES", str(200 * 1024)))
 MAX_ANALYSIS_TOKENS = 8192
+# Files above MAX_FILE_SIZE_BYTES are analyzed in overlapping, line-aligned
+# windows of about ANALYSIS_WINDOW_TOKENS; files above
+# MAX_CHUNKED_FILE_SIZE_BYTES are skipped and never downloaded.
+MAX_CHUNKED_FILE_SIZE_BYTES = int(os.getenv("MAX_CHUNKED_FILE_SIZE_BYTES", str(2 * 1024 * 1024)))
+ANALYSIS_WINDOW_TOKENS = int(os.getenv("ANALYSIS_WINDOW_TOKENS", "16000"))
+ANALYSIS_WINDOW_OVERLAP_LINES = int(os.getenv("ANALYSIS_WINDOW_OVERLAP_LINES", "40"))
+# Files of at most BATCH_MAX_FILE_TOKENS are packed together into a single
+# request of up to BATCH_TOKEN_BUDGET tokens and BATCH_MAX_FILES files.
+BATCH_MAX_FILE_TOKENS = int(os.getenv("BATCH_MAX_FILE_TOKENS", "1000"))
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "12000"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "20"))
+# Size of the per-scan repository overview sent after SYSTEM_PROMPT; 0 disables it.
+# Both are marked as prompt-cache breakpoints, so the overview is paid for in
+# full once per scan and read from the cache by every later call.
+REPOSITORY_CONTEXT_MAX_TOKENS = int(os.getenv("REPOSITORY_CONTEXT_MAX_TOKENS", "0"))
+# Files can be triaged locally for risk signals (sinks, user input, entry
+# points, risky configuration) before any model call. With TRIAGE_MODE=skip,
+# files scoring below TRIAGE_MIN_SCORE are not analyzed in full: they go to
+# the screening model if one is configured and are dropped otherwise, which
+# can miss vulnerable code the signals do not cover. "off" analyzes every file.
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "off")
+if TRIAGE_MODE not in ("skip", "off"):
+    raise ValueError("TRIAGE_MODE must be 'skip' or 'off'")
+TRIAGE_MIN_SCORE = int(os.getenv("TRIAGE_MIN_SCORE", "1"))
+# Analyze files in order of estimated risk rather than tree order, so the
+# most likely findings arrive first.
+PRIORITIZE_BY_RISK = os.getenv("PRIORITIZE_BY_RISK", "true").lower() == "true"
+# Model calls in flight are governed by an AIMD window shared by all scans:
+# it starts at INITIAL_CONCURRENT_ANALYSES, grows while calls succeed and is
+# halved on throttling, never leaving [1, MAX_CONCURRENT_ANALYSES].
+INITIAL_CONCURRENT_ANALYSES = int(os.getenv("INITIAL_CONCURRENT_ANALYSES", "4"))
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "32"))
+# Tokens per minute (input plus output) each model may use across all scans in
+# the process; 0 means unlimited. TOKENS_PER_MINUTE_BY_MODEL overrides the
+# default for individual models, as "model-id=limit,model-id=limit".
+TOKENS_PER_MINUTE = int(os.getenv("TOKENS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE_BY_MODEL = parse_model_limits(os.getenv("TOKENS_PER_MINUTE_BY_MODEL", ""))
+# Model calls per minute each model may start; 0 means unlimited.
+REQUESTS_PER_MINUTE = int(os.getenv("REQUESTS_PER_MINUTE", "0"))
+# Token and request budgets are kept in this SQLite file, so every uvicorn worker
+# on the host draws from the same account-wide budget. Empty keeps them per process.
+RATE_LIMIT_STATE_PATH = os.getenv(
+    "RATE_LIMIT_STATE_PATH", str(Path(__file__).parent / '.cache' / 'rate_limits.sqlite3')
+)
+# Throttled files are re-queued with backoff until this many attempts were made.
+MAX_ANALYSIS_ATTEMPTS = int(os.getenv("MAX_ANALYSIS_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_SECONDS = 2.0
+RETRY_MAX_DELAY_SECONDS = 60.0
+# Connection pool shared by every model call in the process. Idle connections
+# are kept for BEDROCK_KEEPALIVE_SECONDS so bursts of calls skip the TLS handshake.
+BEDROCK_MAX_CONNECTIONS = int(os.getenv("BEDROCK_MAX_CONNECTIONS", str(max(100, MAX_CONCURRENT_ANALYSES))))
+BEDROCK_KEEPALIVE_SECONDS = float(os.getenv("BEDROCK_KEEPALIVE_SECONDS", "60"))
+# Regions model calls are spread over, as "us-east-1,us-west-2"; defaults to
+# AWS_REGION alone. Each region's quota adds to the total throughput.
+BEDROCK_REGIONS = [
+    region.strip() for region in os.getenv("BEDROCK_REGIONS", AWS_REGION).split(",") if region.strip()
+]
+# Send model calls to this URL instead of Bedrock, unauthenticated, e.g. to the
+# stub in stub_bedrock.py. "{region}" is replaced by each region's name.
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL", "")
+
+# Analyses are cached by content hash, model and prompt; an empty path disables the cache.
+ANALYSIS_CACHE_PATH = os.getenv(
+    "ANALYSIS_CACHE_PATH", str(Path(__file__).parent / '.cache' / 'analysis_cache.sqlite3')
+)
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "200000"))
+
+# Bare mirrors reused across scans of the same repository; least recently
+# used mirrors are removed once they take up more than MIRROR_CACHE_MAX_BYTES.
+MIRROR_CACHE_DIR = os.getenv("MIRROR_CACHE_DIR", str(Path(__file__).parent / '.cache' / 'mirrors'))
+MIRROR_CACHE_MAX_BYTES = int(os.getenv("MIRROR_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))
+
+# Background scans started through POST /scans, and the events they emitted,
+# are kept in SCAN_JOBS_PATH for SCAN_JOBS_TTL_SECONDS after they finish.
+SCAN_JOBS_PATH = os.getenv("SCAN_JOBS_PATH", str(Path(__file__).parent / '.cache' / 'scan_jobs.sqlite3'))
+SCAN_JOBS_TTL_SECONDS = int(os.getenv("SCAN_JOBS_TTL_SECONDS", str(7 * 24 * 3600)))
+MAX_RUNNING_SCANS = int(os.getenv("MAX_RUNNING_SCANS", "4"))
+# Most recent events kept per job for clients reconnecting with Last-Event-ID.
+SCAN_EVENT_LOG_MAX_EVENTS = int(os.getenv("SCAN_EVENT_LOG_MAX_EVENTS", "20000"))
+SCAN_JOB_HEARTBEAT_SECONDS = 10.0
 
 SCAN_EXTENSIONS = (
     '.py', '.js', '.jsx', '.java', '.rb', '.php', '.go', '.ts', '.tsx',
@@ -39,7 +139,14 @@ SKIP_DIRS = {
     '__pycache__', '.venv', 'venv', 'target', 'coverage',
 }
 
-app = FastAPI(title="Code Security Scanner API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await bedrock_pool.close()
+
+
+app = FastAPI(title="Code Security Scanner API", lifespan=lifespan)
 
 allowed_origins = [
     origin.strip()
@@ -55,22 +162,148 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-bedrock_client = AnthropicBedrockMantle(aws_region=AWS_REGION)
 
-SYSTEM_PROMPT = """You are a security expert analyzing code for vulnerabilities. For each vulnerability found, provide:
+def create_bedrock_client(region: str) -> AsyncAnthropicBedrockMantle:
+    endpoint = {}
+    if BEDROCK_ENDPOINT_URL:
+        endpoint = {"base_url": BEDROCK_ENDPOINT_URL.replace("{region}", region), "skip_auth": True}
+    return AsyncAnthropicBedrockMantle(
+        aws_region=region,
+        # No SDK retries: a throttled call has to reach the AIMD window and the
+        # retry queue, and with several regions a failed call moves on to the
+        # next region instead of being retried where it failed.
+        max_retries=0,
+        http_client=anthropic.DefaultAsyncHttpxClient(limits=httpx2.Limits(
+            max_connections=BEDROCK_MAX_CONNECTIONS,
+            max_keepalive_connections=BEDROCK_MAX_CONNECTIONS,
+            keepalive_expiry=BEDROCK_KEEPALIVE_SECONDS,
+        )),
+        **endpoint,
+    )
+
+
+bedrock_pool = BedrockPool({region: create_bedrock_client(region) for region in BEDROCK_REGIONS})
+analysis_concurrency = AdaptiveConcurrency(
+    initial=INITIAL_CONCURRENT_ANALYSES, minimum=1, maximum=MAX_CONCURRENT_ANALYSES,
+)
+token_budgets = TokenBudgets(
+    TOKENS_PER_MINUTE, TOKENS_PER_MINUTE_BY_MODEL, REQUESTS_PER_MINUTE,
+    store=SharedBudgetStore(RATE_LIMIT_STATE_PATH) if RATE_LIMIT_STATE_PATH else None,
+)
+
+SYSTEM_PROMPT = """You are a security expert analyzing code for vulnerabilities. Report every vulnerability you find with the report_findings tool, giving for each:
 1. File name
 2. Line number (if applicable)
-3. Description of the vulnerability
+3. CWE identifier
 4. Severity level (High, Medium, Low)
-5. Recommended fix
+5. A one or two sentence description of the vulnerability
+6. A concise recommended fix
 
-If no vulnerabilities are found, simply state "No vulnerabilities found in this file."
+If no vulnerabilities are found, call report_findings with an empty list of findings.
 """
 
+REPORT_FINDINGS_TOOL = {
+    "name": "report_findings",
+    "description": "Report the security vulnerabilities found in the analyzed code.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "findings": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "file": {"type": "string"},
+                        "line": {"type": ["integer", "null"]},
+                        "cwe": {"type": ["string", "null"], "description": "e.g. CWE-89"},
+                        "severity": {"type": "string", "enum": ["High", "Medium", "Low"]},
+                        "description": {"type": "string"},
+                        "fix": {"type": "string"},
+                    },
+                    "required": ["file", "line", "cwe", "severity", "description", "fix"],
+                },
+            },
+            "reviewed_files": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Every file that was analyzed, whether or not it has findings.",
+            },
+        },
+        "required": ["findings"],
+    },
+}
+REPORT_FINDINGS_TOOL_TOKENS = estimate_tokens(json.dumps(REPORT_FINDINGS_TOOL))
+
+SCREENING_PROMPT = """You are a security expert screening code before a full security review. For each file, decide whether it could plausibly contain a security vulnerability, such as injection, unsafe deserialization, missing authentication or authorization, hardcoded secrets, weak cryptography or unsafe memory handling.
+
+Call report_suspicious_files with the path of every file that needs a full review, exactly as given. When in doubt, include the file. Files you leave out are not reviewed further.
+"""
+
+REPORT_SUSPICIOUS_FILES_TOOL = {
+    "name": "report_suspicious_files",
+    "description": "Report the files that need a full security review.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "suspicious_files": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["suspicious_files"],
+    },
+}
+SCREENING_TOOL_TOKENS = estimate_tokens(json.dumps(REPORT_SUSPICIOUS_FILES_TOOL))
+# Cached analyses are only valid for the prompt and output schema they were produced with.
+SYSTEM_PROMPT_SHA = sha256_text(SYSTEM_PROMPT + json.dumps(REPORT_FINDINGS_TOOL, sort_keys=True))
+
+analysis_cache = None
+if ANALYSIS_CACHE_PATH:
+    analysis_cache = AnalysisCache(
+        ANALYSIS_CACHE_PATH, ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS, max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+    )
+    analysis_cache.prune()
+
+mirror_cache = MirrorCache(MIRROR_CACHE_DIR, max_bytes=MIRROR_CACHE_MAX_BYTES)
+
+scan_jobs = ScanJobs(
+    ScanJobStore(SCAN_JOBS_PATH, ttl_seconds=SCAN_JOBS_TTL_SECONDS, max_events=SCAN_EVENT_LOG_MAX_EVENTS),
+    max_running=MAX_RUNNING_SCANS, heartbeat_seconds=SCAN_JOB_HEARTBEAT_SECONDS,
+)
+scan_flights = ScanFlights()
+scan_jobs.store.interrupt_stale(scan_jobs.stale_after_seconds)
+scan_jobs.store.prune()
+
 
 class RepositoryScanRequest(BaseModel):
     repository_url: str
     access_token: Optional[str] = None
+    # With base_ref set, only files added or modified between base_ref and
+    # head_ref (default: the repository's default branch) are scanned.
+    base_ref: Optional[str] = None
+    head_ref: Optional[str] = None
+    # Files the given scan job already completed (at the same blob) are not
+    # analyzed again; their results are carried over.
+    resume_scan_id: Optional[str] = None
+
+
+class Finding(BaseModel):
+    file: str
+    line: Optional[int] = None
+    cwe: Optional[str] = None
+    severity: Literal['High', 'Medium', 'Low']
+    description: str
+    fix: str
+
+
+class FindingsReport(BaseModel):
+    findings: List[Finding]
+    # None if the model left the list out of a complete report.
+    reviewed_files: Optional[List[str]] = None
+
+
+FINDINGS_ADAPTER = TypeAdapter(List[Finding])
+
+
+class AnalysisRefused(Exception):
+    """The model's safety system declined to analyze the code."""
 
 
 def redact_token(text: str, token: Optional[str]) -> str:
@@ -102,118 +335,1094 @@ def construct_authenticated_url(repo_url: str, token: Optional[str]) -> str:
     ))
 
 
-def analyze_code(relative_file_path: str, content: str) -> str:
-    response = bedrock_client.messages.create(
-        model=MODEL_ID,
-        max_tokens=MAX_ANALYSIS_TOKENS,
-        system=SYSTEM_PROMPT,
-        messages=[{
-            "role": "user",
-            "content": (
-                "Analyze the following code for security vulnerabilities:\n\n"
-                f"File: {relative_file_path}\n"
-                f"Code:\n```\n{content}\n```"
-            ),
-        }],
+def normalize_repository_url(repo_url: str) -> str:
+    """Canonical form of a repository URL for cache keys, with credentials stripped."""
+    parsed_url = urlparse(repo_url)
+    host = (parsed_url.hostname or '').lower()
+    if parsed_url.port:
+        host = f"{host}:{parsed_url.port}"
+    path = parsed_url.path.rstrip('/')
+    if path.endswith('.git'):
+        path = path[:-len('.git')]
+    return urlunparse((parsed_url.scheme.lower(), host, path, '', '', ''))
+
+
+class TokenUsage:
+    """Token counts reported by the model across one scan, including prompt-cache reads and writes."""
+
+    FIELDS = ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens')
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, usage) -> None:
+        for field in self.FIELDS:
+            self.counts[field] += getattr(usage, field, None) or 0
+
+    def summary(self) -> str:
+        return (
+            f"Token usage: {self.counts['input_tokens']} input, {self.counts['output_tokens']} output, "
+            f"{self.counts['cache_read_input_tokens']} read from and "
+            f"{self.counts['cache_creation_input_tokens']} written to the prompt cache."
+        )
+
+
+def rate_limited_tokens(usage) -> int:
+    """Tokens a call counts against the per-minute quota; prompt-cache reads are not counted."""
+    return sum(
+        getattr(usage, field, None) or 0
+        for field in ('input_tokens', 'cache_creation_input_tokens', 'output_tokens')
+    )
+
+
+class TierMetrics:
+    """Calls, latency and token usage of one model tier, either per scan or for the whole process."""
+
+    def __init__(self, model_id: str):
+        self.model_id = model_id
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.usage = TokenUsage()
+        self.files = 0
+        # Screening only: files that were not passed on to the analysis model.
+        self.cleared = 0
+
+    def record(self, usage, seconds: float) -> None:
+        self.calls += 1
+        self.seconds += seconds
+        self.usage.add(usage)
+
+    def snapshot(self) -> dict:
+        return {
+            'model': self.model_id,
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean_latency_seconds': round(self.seconds / self.calls, 3) if self.calls else None,
+            'files': self.files,
+            'cleared': self.cleared,
+            **self.usage.counts,
+        }
+
+
+# Process-wide metrics per tier of the model cascade.
+model_tiers = {'analysis': TierMetrics(MODEL_ID)}
+if SCREENING_MODEL_ID:
+    model_tiers['screening'] = TierMetrics(SCREENING_MODEL_ID)
+
+
+class FindingStream:
+    """Events for findings streamed by calls still in flight, waiting for the scan loop to send them."""
+
+    def __init__(self):
+        self.events = []
+        self.ready = asyncio.Event()
+
+    def publish(self, event: str) -> None:
+        self.events.append(event)
+        self.ready.set()
+
+    def drain(self) -> List[str]:
+        events, self.events = self.events, []
+        self.ready.clear()
+        return events
+
+
+class ScanContext(NamedTuple):
+    """Per-scan state shared by every model call of the scan."""
+    usage: TokenUsage
+    repository_preamble: Optional[str] = None
+    # The scan's own screening metrics, when a screening model is configured.
+    screening: Optional[TierMetrics] = None
+    # Set when STREAM_FINDINGS is on.
+    finding_stream: Optional[FindingStream] = None
+
+
+def build_repository_preamble(repo_url: str, head: str, paths, max_tokens: int) -> Optional[str]:
+    """Describe the repository being scanned, within max_tokens, as shared context for every call."""
+    if max_tokens <= 0:
+        return None
+    lines = [
+        f"Repository under review: {normalize_repository_url(repo_url)} at commit {head}.",
+        "Files in scope, for context when judging how code is reached:",
+    ]
+    budget = max_tokens - estimate_tokens("\n".join(lines))
+    for relative_file_path in paths:
+        budget -= estimate_tokens(relative_file_path) + 1
+        if budget < 0:
+            lines.append("...")
+            break
+        lines.append(relative_file_path)
+    return "\n".join(lines)
+
+
+async def analyze_code(relative_file_path: str, content: str, focus_lines: Optional[Tuple[int, int]] = None,
+                       context: Optional[ScanContext] = None) -> List[Finding]:
+    prompt = (
+        "Analyze the following code for security vulnerabilities:\n\n"
+        f"File: {relative_file_path}\n"
+    )
+    if focus_lines:
+        prompt += (
+            f"Lines: {focus_lines[0]}-{focus_lines[1]} (each line is prefixed with its line number in the file; "
+            "lines outside this range are context only, so report only vulnerabilities within it)\n"
+        )
+    prompt += f"Code:\n```\n{content}\n```"
+
+    report = await request_analysis(prompt, context, [relative_file_path])
+    # The file name is known; do not depend on the model echoing it back.
+    return [finding.model_copy(update={'file': relative_file_path}) for finding in report.findings]
+
+
+async def analyze_batch(files, context: Optional[ScanContext] = None) -> dict:
+    """Analyze several small files in one request and return {path: findings}.
+
+    Files the model did not list as reviewed (for example because the output
+    was cut off) are missing from the result, and the caller analyzes them
+    on their own. So is the whole batch if a finding names an unknown file.
+    A complete report without a reviewed_files list covers every file.
+    """
+    prompt = (
+        "Analyze each of the following files for security vulnerabilities independently. "
+        "Report the findings for all of them in a single report_findings call, using each file "
+        "path exactly as given, and list every file you analyzed in reviewed_files.\n\n"
     )
+    prompt += "\n\n".join(
+        f"File: {relative_file_path}\nCode:\n```\n{content}\n```" for relative_file_path, content in files
+    )
+
+    try:
+        report = await request_analysis(prompt, context, [relative_file_path for relative_file_path, _ in files])
+    except AnalysisRefused:
+        return {}
+    requested_paths = {relative_file_path for relative_file_path, _ in files}
+    if any(finding.file not in requested_paths for finding in report.findings):
+        return {}
+    reviewed_paths = requested_paths
+    if report.reviewed_files is not None:
+        reviewed_paths = requested_paths.intersection(report.reviewed_files)
+    results = {path: [] for path in reviewed_paths}
+    for finding in report.findings:
+        results.setdefault(finding.file, []).append(finding)
+    return results
+
+
+async def create_message(model_id: str, max_tokens: int, system: list, tool: dict, tool_tokens: int, prompt: str,
+                         metrics: List[TierMetrics], on_event=None):
+    """Call model_id, forcing tool, within the model's request and token budgets.
+
+    With on_event, the response is streamed and each stream event passed to it.
+    """
+    requests = token_budgets.requests(model_id)
+    if requests:
+        await requests.acquire(1)
+    # Reserve the whole prompt plus the output limit against the model's
+    # token budget, then give back whatever the call did not use.
+    bucket = token_budgets.bucket(model_id)
+    reserved = used = 0
+    if bucket:
+        reserved = await bucket.acquire(
+            sum(estimate_tokens(block["text"]) for block in system) + estimate_tokens(prompt)
+            + tool_tokens + max_tokens
+        )
+    started = time.monotonic()
+    try:
+        request = dict(
+            model=model_id,
+            max_tokens=max_tokens,
+            system=system,
+            tools=[tool],
+            tool_choice={"type": "tool", "name": tool["name"]},
+            messages=[{"role": "user", "content": prompt}],
+        )
+        if on_event:
+            response = await bedrock_pool.stream(on_event, **request)
+        else:
+            response = await bedrock_pool.create(**request)
+        used = rate_limited_tokens(response.usage)
+    except Exception:
+        for tier in metrics:
+            tier.errors += 1
+        raise
+    finally:
+        if bucket:
+            await bucket.settle(reserved, used)
+    for tier in metrics:
+        tier.record(response.usage, time.monotonic() - started)
+    return response
+
+
+async def screen_files(files, context: ScanContext) -> set:
+    """Ask the screening model which of files need a full analysis and return their paths.
+
+    Screening fails open: if the call fails, or its answer is cut off or
+    names a file that was not sent, every file is returned. Throttling is
+    the exception; it is raised, so the item is retried like any other.
+    """
+    requested_paths = {relative_file_path for relative_file_path, _ in files}
+    metrics = [model_tiers['screening'], context.screening]
+    prompt = "Screen the following files:\n\n" + "\n\n".join(
+        f"File: {relative_file_path}\nCode:\n```\n{content}\n```" for relative_file_path, content in files
+    )
+    try:
+        response = await create_message(
+            SCREENING_MODEL_ID, SCREENING_MAX_TOKENS,
+            [{"type": "text", "text": SCREENING_PROMPT, "cache_control": {"type": "ephemeral"}}],
+            REPORT_SUSPICIOUS_FILES_TOOL, SCREENING_TOOL_TOKENS, prompt, metrics,
+        )
+    except anthropic.RateLimitError:
+        raise
+    except Exception as e:
+        print(f"Screening failed, analyzing {len(files)} file(s) in full: {e}")
+        return requested_paths
+    for tier in metrics:
+        tier.files += len(files)
+    if response.stop_reason != "tool_use":
+        return requested_paths
+    for block in response.content:
+        if block.type == "tool_use" and block.name == REPORT_SUSPICIOUS_FILES_TOOL["name"]:
+            suspicious = block.input.get("suspicious_files")
+            if not isinstance(suspicious, list) or not requested_paths.issuperset(suspicious):
+                return requested_paths
+            for tier in metrics:
+                tier.cleared += len(requested_paths) - len(set(suspicious))
+            return set(suspicious)
+    return requested_paths
+
+
+def publish_streamed_findings(stream: FindingStream, paths: List[str]):
+    """Return a stream event handler that publishes each finding of report_findings once it is complete.
+
+    The SDK parses the tool input as it streams in; every finding in it but
+    the last is complete. With a single path, findings are attributed to it;
+    otherwise findings naming a file that was not sent are dropped.
+    """
+    published = 0
+
+    def on_event(event) -> None:
+        nonlocal published
+        if event.type != "input_json" or not isinstance(event.snapshot, dict):
+            return
+        findings = event.snapshot.get("findings")
+        if not isinstance(findings, list):
+            return
+        while published < len(findings) - 1:
+            published += 1
+            try:
+                finding = Finding.model_validate(findings[published - 1])
+            except ValidationError:
+                continue
+            if len(paths) == 1:
+                finding = finding.model_copy(update={'file': paths[0]})
+            elif finding.file not in paths:
+                continue
+            stream.publish(sse_event('finding', finding.model_dump()))
+
+    return on_event
+
+
+async def request_analysis(prompt: str, context: Optional[ScanContext] = None,
+                           paths: Optional[List[str]] = None) -> FindingsReport:
+    """Send one analysis request and return the findings reported through the tool.
+
+    SYSTEM_PROMPT and the scan's repository preamble are prompt-cache
+    breakpoints, so only the per-file prompt is billed at the full rate.
+    When the scan streams findings, those of the files in paths are
+    published while the response is still being written.
+    """
+    system = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+    if context and context.repository_preamble:
+        system.append({"type": "text", "text": context.repository_preamble, "cache_control": {"type": "ephemeral"}})
+
+    on_event = None
+    if context and context.finding_stream and paths:
+        on_event = publish_streamed_findings(context.finding_stream, paths)
+    response = await create_message(
+        MODEL_ID, MAX_ANALYSIS_TOKENS, system, REPORT_FINDINGS_TOOL, REPORT_FINDINGS_TOOL_TOKENS, prompt,
+        [model_tiers['analysis']], on_event,
+    )
+    if context:
+        context.usage.add(response.usage)
     if response.stop_reason == "refusal":
-        return "Analysis was declined by the model's safety system for this file."
-    return "".join(block.text for block in response.content if block.type == "text")
+        raise AnalysisRefused()
+    for block in response.content:
+        if block.type == "tool_use" and block.name == REPORT_FINDINGS_TOOL["name"]:
+            try:
+                report = FindingsReport.model_validate(block.input)
+            except ValidationError as e:
+                raise ValueError(f"Model returned malformed findings (stop reason: {response.stop_reason})") from e
+            # A report cut off by the output limit vouches for no file it does not list.
+            if report.reviewed_files is None and response.stop_reason != "tool_use":
+                report.reviewed_files = []
+            return report
+    raise ValueError(f"Model did not report findings (stop reason: {response.stop_reason})")
+
+
+def is_scannable_path(relative_file_path: str) -> bool:
+    *dir_names, file_name = relative_file_path.split('/')
+    return file_name.endswith(SCAN_EXTENSIONS) and not SKIP_DIRS.intersection(dir_names)
+
+
+def fetch_scan_refs(repo: Repo, fetch_url: str, base_ref: Optional[str], head_ref: Optional[str]):
+    """Fetch the commits to scan into a mirror and return their (base, head) SHAs.
 
+    Each ref is fetched at depth 1, since a scan (or a diff between two
+    commits) only needs their trees. Without head_ref the remote's default
+    branch is scanned. Blobs too large to analyze are filtered out on the
+    server, so they never cross the network (a partial clone).
+    """
+    refs = {'head': head_ref or 'HEAD'}
+    if base_ref:
+        refs['base'] = base_ref
+    for ref in refs.values():
+        if ref.startswith('-') or any(c.isspace() for c in ref):
+            raise ValueError(f"Invalid git ref: {ref!r}")
+    refspecs = [f'+{ref}:refs/scan/{name}' for name, ref in refs.items()]
 
-def iter_scannable_files(root_dir: str):
-    for subdir, dirs, files in os.walk(root_dir):
-        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
-        for file_name in files:
-            if file_name.endswith(SCAN_EXTENSIONS):
-                yield os.path.join(subdir, file_name)
+    # --filter only works against a promisor remote, so "origin" exists only
+    # for the duration of the fetch; its URL (and token) is never written to
+    # the mirror's config, which also keeps git from lazily fetching the
+    # omitted blobs later.
+    with repo.config_writer() as config:
+        config.set_value('core', 'repositoryformatversion', 1)
+        config.set_value('extensions', 'partialClone', 'origin')
+    blob_filter = f'blob:limit={MAX_CHUNKED_FILE_SIZE_BYTES + 1}'
+    repo.git(c=[
+        f'remote.origin.url={fetch_url}', 'remote.origin.promisor=true',
+    ]).fetch('--depth=1', '--no-tags', f'--filter={blob_filter}', 'origin', *refspecs)
+
+    head = repo.git.rev_parse('refs/scan/head^{commit}')
+    base = repo.git.rev_parse('refs/scan/base^{commit}') if base_ref else None
+    return base, head
+
+
+def fetch_scan_commits(repository_key: str, fetch_url: str, base_ref: Optional[str], head_ref: Optional[str]):
+    """Refresh the repository's mirror and return it with the (base, head) commits to scan."""
+    with mirror_cache.locked(repository_key) as mirror_path:
+        repo = Repo(mirror_path)
+        base, head = fetch_scan_refs(repo, fetch_url, base_ref, head_ref)
+    return repo, base, head
+
+
+def read_blob(repo: Repo, blob_sha: str) -> bytes:
+    """Read a blob through the repo's long-lived `git cat-file --batch` process.
+
+    The process is owned by this Repo instance and is not thread-safe, so
+    blobs for a scan are read from one thread only.
+    """
+    return repo.git.get_object_data(blob_sha)[3]
+
+
+def list_omitted_blobs(repo: Repo, rev: str) -> set:
+    """Blobs of rev that the partial clone filter left on the server."""
+    output = repo.git.rev_list('--objects', '--missing=print', rev)
+    return {line[1:] for line in output.splitlines() if line.startswith('?')}
+
+
+def list_changed_paths(repo: Repo, base: str, head: str) -> set:
+    """Paths added or modified between two commits; deletions have nothing to scan."""
+    output = repo.git.diff('--name-only', '-z', '--no-renames', '--diff-filter=AM', base, head)
+    return {path for path in output.split('\0') if path}
+
+
+def list_scannable_blobs(repo: Repo, rev: str = 'HEAD', paths: Optional[set] = None):
+    """Return (path, blob SHA) for scannable files, straight from the git tree.
+
+    Symlinks and submodules are left out; only regular file blobs are listed.
+    When paths is given, the listing is restricted to those paths. Sizes are
+    not requested, as that would make git fetch the blobs the partial clone
+    left out.
+    """
+    listing = repo.git.ls_tree('-r', '-z', rev)
+    entries = []
+    for record in listing.split('\0'):
+        if not record:
+            continue
+        meta, relative_file_path = record.split('\t', 1)
+        mode, object_type, blob_sha = meta.split()
+        if object_type != 'blob' or mode == '120000' or not is_scannable_path(relative_file_path):
+            continue
+        if paths is not None and relative_file_path not in paths:
+            continue
+        entries.append((relative_file_path, blob_sha))
+    return entries
 
 
 def sse_event(event_type: str, payload) -> str:
     return f"data: {json.dumps({'type': event_type, 'payload': payload})}\n\n"
 
 
-async def stream_scan_events(repo_url: str, access_token: Optional[str]):
-    temp_dir = None
+class AnalysisItem(NamedTuple):
+    """One model call: a whole file, or one window of a file analyzed in chunks."""
+    relative_file_path: str
+    content: str
+    focus_lines: Optional[Tuple[int, int]] = None
+    # Whether the screening model decides if the file gets a full analysis.
+    screen: bool = False
+
+    @property
+    def label(self) -> str:
+        if self.focus_lines is None:
+            return self.relative_file_path
+        return f'{self.relative_file_path} (lines {self.focus_lines[0]}-{self.focus_lines[1]})'
+
+    @property
+    def content_sha(self) -> str:
+        if self.focus_lines is None:
+            return sha256_text(self.content)
+        return sha256_text(f'{self.focus_lines}\n{self.content}')
+
+
+class AnalysisBatch(NamedTuple):
+    """Several small whole files analyzed in one model call."""
+    items: Tuple[AnalysisItem, ...]
+
+    @property
+    def label(self) -> str:
+        return f'batch of {len(self.items)} files ({self.items[0].relative_file_path}, ...)'
+
+
+def format_findings(findings: List[Finding]) -> str:
+    """Human-readable rendering of findings, for clients that only show text."""
+    entries = []
+    for finding in findings:
+        location = f"line {finding.line}" if finding.line else "file"
+        cwe = f" ({finding.cwe})" if finding.cwe else ""
+        entries.append(f"[{finding.severity}] {location}{cwe}: {finding.description}\nFix: {finding.fix}")
+    return "\n\n".join(entries)
+
+
+def analysis_result_events(relative_file_path: str, findings: List[Finding]):
+    if findings:
+        return True, [sse_event('vulnerability', {
+            'file': relative_file_path,
+            'analysis': format_findings(findings),
+            'findings': [finding.model_dump() for finding in findings],
+        })]
+    return False, [sse_event('info', f'No vulnerabilities found in: {relative_file_path}')]
+
+
+def merge_window_findings(window_results: dict) -> List[Finding]:
+    """Combine the findings of a chunked file's windows, dropping duplicates.
+
+    Windows are told to report only on their own lines, but a finding in the
+    overlap may still be reported by both neighbours; a finding identical in
+    line, CWE and description to one from an earlier window is dropped.
+    Findings within one window are all kept.
+    """
+    merged = []
+    first_window = {}
+    for lines, findings in sorted(window_results.items()):
+        for finding in findings:
+            key = (finding.line, finding.cwe, finding.description)
+            if first_window.setdefault(key, lines) != lines:
+                continue
+            merged.append(finding)
+    return sorted(merged, key=lambda finding: finding.line or 0)
+
+
+def get_cached_findings(content_sha: Optional[str] = None, blob_sha: Optional[str] = None) -> Optional[List[Finding]]:
+    if not analysis_cache:
+        return None
+    if blob_sha:
+        cached = analysis_cache.get_by_blob(blob_sha, MODEL_ID, SYSTEM_PROMPT_SHA)
+    else:
+        cached = analysis_cache.get(content_sha, MODEL_ID, SYSTEM_PROMPT_SHA)
+    return FINDINGS_ADAPTER.validate_json(cached) if cached is not None else None
+
+
+def cache_findings(content_sha: str, findings: List[Finding]) -> None:
+    if analysis_cache:
+        analysis_cache.put(content_sha, MODEL_ID, SYSTEM_PROMPT_SHA, FINDINGS_ADAPTER.dump_json(findings).decode())
+
+
+async def run_analysis(item, access_token: Optional[str], context: ScanContext):
+    """Run one model call and return (findings, error_events); findings is None on failure.
+
+    For an AnalysisBatch the findings are a {path: findings} dict. Files
+    marked for screening are screened first and those the screening model
+    clears are reported without findings. Cleared files are not cached,
+    since no full analysis was made of them.
+    """
+    epoch = await analysis_concurrency.acquire()
+    throttled = False
     try:
-        authenticated_repo_url = construct_authenticated_url(repo_url, access_token)
+        if isinstance(item, AnalysisBatch):
+            files = [(file_item.relative_file_path, file_item.content) for file_item in item.items]
+            findings_by_file = {}
+            to_screen = [
+                (file_item.relative_file_path, file_item.content) for file_item in item.items if file_item.screen
+            ]
+            if to_screen:
+                suspicious = await screen_files(to_screen, context)
+                findings_by_file = {path: [] for path, _ in to_screen if path not in suspicious}
+                files = [(path, content) for path, content in files if path not in findings_by_file]
+            if files:
+                analyzed = await analyze_batch(files, context)
+                for file_item in item.items:
+                    if file_item.relative_file_path in analyzed:
+                        cache_findings(file_item.content_sha, analyzed[file_item.relative_file_path])
+                findings_by_file.update(analyzed)
+            return findings_by_file, []
 
-        display_url = repo_url if not access_token else "provided URL (token redacted)"
-        yield sse_event('status', f'Cloning repository from {display_url}...')
+        if item.screen:
+            if not await screen_files([(item.relative_file_path, item.content)], context):
+                return [], []
+        findings = await analyze_code(item.relative_file_path, item.content, item.focus_lines, context)
+        cache_findings(item.content_sha, findings)
+        return findings, []
+
+    except AnalysisRefused:
+        return None, [sse_event('error', f"Analysis was declined by the model's safety system for {item.label}.")]
+    except anthropic.RateLimitError:
+        # Surface to the scan loop, which owns the retry queue.
+        throttled = True
+        raise
+    except anthropic.APIStatusError as e:
+        return None, [sse_event('error', f'Model API error ({e.status_code}) while analyzing {item.label}.')]
+    except Exception as e:
+        error_message = redact_token(f"Error processing file {item.label}: {e}", access_token)
+        print(error_message)
+        return None, [sse_event('error', error_message)]
+    finally:
+        analysis_concurrency.release(epoch, throttled)
 
-        temp_dir = tempfile.mkdtemp()
-        # Shallow clone in a worker thread so the event loop is not blocked.
-        await asyncio.to_thread(Repo.clone_from, authenticated_repo_url, temp_dir, depth=1)
-        yield sse_event('status', 'Repository cloned successfully.')
+
+async def scan_files(
+    repo: Repo,
+    repo_url: str,
+    head: str,
+    changed_paths: Optional[set],
+    access_token: Optional[str],
+    scan_id: Optional[str] = None,
+    resume_scan_id: Optional[str] = None,
+):
+    """Analyze the scannable files of head, or just changed_paths if given, yielding SSE events."""
+    pending = {}
+    try:
+        scannable_blobs = await asyncio.to_thread(list_scannable_blobs, repo, head, changed_paths)
+        omitted_blobs = await asyncio.to_thread(list_omitted_blobs, repo, head)
+        context = ScanContext(
+            usage=TokenUsage(),
+            repository_preamble=build_repository_preamble(
+                repo_url, head, [relative_file_path for relative_file_path, _ in scannable_blobs],
+                REPOSITORY_CONTEXT_MAX_TOKENS,
+            ),
+            screening=TierMetrics(SCREENING_MODEL_ID) if SCREENING_MODEL_ID else None,
+            finding_stream=FindingStream() if STREAM_FINDINGS else None,
+        )
+        # Completed files are checkpointed when running as a job, keyed by
+        # blob SHA, so a resumed scan only skips files that are unchanged.
+        blob_shas = {}
+        resume_checkpoints = {}
+        if resume_scan_id:
+            resume_checkpoints = await asyncio.to_thread(scan_jobs.store.checkpoints, resume_scan_id)
+
+        # Blob cache lookups made while ordering the files, reused by the scan
+        # loop so each blob is looked up (and counted as a hit or miss) once.
+        blob_lookups = {}
+
+        def cached_blob_findings(blob_sha: str) -> Optional[List[Finding]]:
+            if blob_sha not in blob_lookups:
+                blob_lookups[blob_sha] = get_cached_findings(blob_sha=blob_sha)
+            return blob_lookups[blob_sha]
+
+        if PRIORITIZE_BY_RISK:
+            # Files answered by a checkpoint or the cache from the tree listing
+            # alone go first. The rest are ordered by their paths, so no file
+            # is read before analysis starts.
+            answered = []
+            unanswered = []
+            for relative_file_path, blob_sha in scannable_blobs:
+                checkpoint = resume_checkpoints.get(relative_file_path)
+                if (checkpoint is not None and checkpoint[0] == blob_sha) or (
+                    blob_sha not in omitted_blobs and cached_blob_findings(blob_sha) is not None
+                ):
+                    answered.append((relative_file_path, blob_sha))
+                else:
+                    unanswered.append((relative_file_path, blob_sha))
+            if unanswered:
+                unanswered.sort(key=lambda blob: -path_priority(blob[0]))
+                yield sse_event('status', f'Ordered {len(unanswered)} file(s) by estimated risk; riskiest first.')
+            scannable_blobs = answered + unanswered
 
         vulnerabilities_found_overall = False
         scanned_files_count = 0
+        cached_files_count = 0
+        resumed_files_count = 0
+        triaged_out_count = 0
+        attempts = {}
+        unscanned_files = []
+        # Chunked files some of whose windows could not be analyzed.
+        partial_files = []
+        # Whole files whose analysis failed (API errors, refusals, ...).
+        failed_files = []
+        chunked_files = {}
+        batch = []
+        retry_queue = RetryQueue(RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS)
+        # Files a batch response did not cover, to be analyzed on their own.
+        unbatched_items = []
 
-        for file_path in iter_scannable_files(temp_dir):
-            relative_file_path = os.path.relpath(file_path, temp_dir)
-            yield sse_event('progress', f'Scanning file: {relative_file_path}')
-            scanned_files_count += 1
+        def schedule_analysis(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            pending[asyncio.create_task(run_analysis(item, access_token, context))] = item
 
-            try:
-                if os.path.getsize(file_path) > MAX_FILE_SIZE_BYTES:
-                    yield sse_event('info', f'Skipping large file (> {MAX_FILE_SIZE_BYTES // 1024}KB): {relative_file_path}')
+        def schedule_due_retries():
+            while len(pending) < MAX_CONCURRENT_ANALYSES:
+                if unbatched_items:
+                    schedule_analysis(unbatched_items.pop())
                     continue
+                item = retry_queue.pop_due()
+                if item is None:
+                    return
+                schedule_analysis(item)
+
+        async def submit(item):
+            """Schedule item once there is room, yielding the events of analyses finished meanwhile.
+
+            The number of items held in memory for this scan is bounded; the
+            shared AIMD window decides how many of them are actually calling
+            the model. Results are streamed in the order the calls finish, and
+            retries that have come due take precedence over new files.
+            """
+            schedule_due_retries()
+            while len(pending) >= MAX_CONCURRENT_ANALYSES:
+                for event in await collect_finished():
+                    yield event
+                schedule_due_retries()
+            schedule_analysis(item)
+
+        def take_batch():
+            batch_items = tuple(batch)
+            batch.clear()
+            return batch_items[0] if len(batch_items) == 1 else AnalysisBatch(batch_items)
 
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
+        async def record_file_result(relative_file_path: str, findings: List[Finding], complete: bool = True):
+            """Checkpoint a file's final findings and return its result events.
 
-                if not content.strip():
-                    yield sse_event('info', f'Skipping empty file: {relative_file_path}')
+            Partial results, from a chunked file some of whose windows failed,
+            are reported but not checkpointed. Findings replayed from the cache
+            or a checkpoint may name the path they were first found under (the
+            same content elsewhere, or before a rename), so each is rewritten
+            to this file's path.
+            """
+            nonlocal vulnerabilities_found_overall
+            findings = [
+                finding if finding.file == relative_file_path
+                else finding.model_copy(update={'file': relative_file_path})
+                for finding in findings
+            ]
+            if scan_id and complete:
+                await asyncio.to_thread(
+                    scan_jobs.store.checkpoint, scan_id, relative_file_path, blob_shas[relative_file_path],
+                    FINDINGS_ADAPTER.dump_json(findings).decode(),
+                )
+            vulnerable, events = analysis_result_events(relative_file_path, findings)
+            vulnerabilities_found_overall |= vulnerable
+            return events
+
+        async def finish_item(item: AnalysisItem, findings: Optional[List[Finding]]):
+            """Record an item's findings (None if it failed) and return the events it completes."""
+            relative_file_path = item.relative_file_path
+            if item.focus_lines is not None:
+                chunked = chunked_files[relative_file_path]
+                chunked['results'][item.focus_lines] = findings
+                if len(chunked['results']) < chunked['windows']:
+                    return []
+                del chunked_files[relative_file_path]
+                complete = None not in chunked['results'].values()
+                findings = merge_window_findings(
+                    {lines: result for lines, result in chunked['results'].items() if result is not None}
+                )
+                if not complete:
+                    # Never report a file as clean when part of it went unread.
+                    partial_files.append(relative_file_path)
+                    failed = list(chunked['results'].values()).count(None)
+                    events = [sse_event(
+                        'error',
+                        f"Only part of {relative_file_path} was analyzed: {failed} of {chunked['windows']} window(s) failed.",
+                    )]
+                    if findings:
+                        events.extend(await record_file_result(relative_file_path, findings, complete=False))
+                    return events
+                if chunked['content_sha']:
+                    cache_findings(chunked['content_sha'], findings)
+                return await record_file_result(relative_file_path, findings)
+            if findings is None:
+                failed_files.append(relative_file_path)
+                return []
+            return await record_file_result(relative_file_path, findings)
+
+        async def collect_finished():
+            """Wait for a running analysis to finish, a retry to come due or findings to be streamed."""
+            timeout = retry_queue.seconds_until_due()
+            if not pending:
+                await asyncio.sleep(timeout or 0)
+                return context.finding_stream.drain() if context.finding_stream else []
+            waiters = set(pending)
+            streamed = None
+            if context.finding_stream:
+                streamed = asyncio.ensure_future(context.finding_stream.ready.wait())
+                waiters.add(streamed)
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            events = []
+            if streamed:
+                streamed.cancel()
+                done.discard(streamed)
+                events.extend(context.finding_stream.drain())
+            for task in done:
+                item = pending.pop(task)
+                attempt = attempts[item]
+                try:
+                    findings, error_events = task.result()
+                except anthropic.RateLimitError as e:
+                    if attempt >= MAX_ANALYSIS_ATTEMPTS:
+                        events.append(sse_event('error', f'Rate limited while analyzing {item.label}. Giving up after {attempt} attempts.'))
+                        for file_item in item.items if isinstance(item, AnalysisBatch) else [item]:
+                            unscanned_files.append(file_item.label)
+                            events.extend(await finish_item(file_item, None))
+                        continue
+                    delay = retry_queue.push(item, attempt, parse_retry_after(e.response.headers))
+                    events.append(sse_event(
+                        'info',
+                        f'Rate limited while analyzing {item.label} (attempt {attempt}/{MAX_ANALYSIS_ATTEMPTS}). Retrying in {delay:.1f}s.',
+                    ))
                     continue
+                events.extend(error_events)
+                if isinstance(item, AnalysisBatch):
+                    findings_by_file = findings or {}
+                    for file_item in item.items:
+                        if file_item.relative_file_path in findings_by_file:
+                            events.extend(await finish_item(file_item, findings_by_file[file_item.relative_file_path]))
+                        else:
+                            unbatched_items.append(file_item)
+                    continue
+                events.extend(await finish_item(item, findings))
+            return events
 
-                analysis_result = await asyncio.to_thread(analyze_code, relative_file_path, content)
+        for relative_file_path, blob_sha in scannable_blobs:
+            yield sse_event('progress', f'Scanning file: {relative_file_path}')
+            scanned_files_count += 1
+            blob_shas[relative_file_path] = blob_sha
 
-                if analysis_result and "No vulnerabilities found" not in analysis_result:
-                    vulnerabilities_found_overall = True
-                    yield sse_event('vulnerability', {'file': relative_file_path, 'analysis': analysis_result})
-                else:
-                    yield sse_event('info', f'No vulnerabilities found in: {relative_file_path}')
+            checkpoint = resume_checkpoints.get(relative_file_path)
+            if checkpoint is not None and checkpoint[0] == blob_sha:
+                resumed_files_count += 1
+                for event in await record_file_result(relative_file_path, FINDINGS_ADAPTER.validate_json(checkpoint[1])):
+                    yield event
+                continue
+
+            if blob_sha in omitted_blobs:
+                yield sse_event('info', f'Skipping large file (> {MAX_CHUNKED_FILE_SIZE_BYTES // 1024}KB): {relative_file_path}')
+                continue
 
-            except anthropic.RateLimitError:
-                yield sse_event('error', f'Rate limited while analyzing {relative_file_path}. Waiting before retrying next file...')
-                await asyncio.sleep(10)
-            except anthropic.APIStatusError as e:
-                yield sse_event('error', f'Model API error ({e.status_code}) while analyzing {relative_file_path}.')
+            # Unchanged files are answered from the tree listing alone.
+            cached_findings = cached_blob_findings(blob_sha)
+            if cached_findings is not None:
+                cached_files_count += 1
+                for event in await record_file_result(relative_file_path, cached_findings):
+                    yield event
+                continue
+
+            try:
+                data = read_blob(repo, blob_sha)
             except Exception as e:
                 error_message = redact_token(f"Error processing file {relative_file_path}: {e}", access_token)
                 print(error_message)
                 yield sse_event('error', error_message)
+                continue
+
+            # Servers that do not support partial clone send every blob.
+            if len(data) > MAX_CHUNKED_FILE_SIZE_BYTES:
+                yield sse_event('info', f'Skipping large file (> {MAX_CHUNKED_FILE_SIZE_BYTES // 1024}KB): {relative_file_path}')
+                continue
+            content = data.decode('utf-8', errors='ignore')
+
+            if not content.strip():
+                yield sse_event('info', f'Skipping empty file: {relative_file_path}')
+                continue
+
+            content_sha = None
+            if analysis_cache:
+                content_sha = sha256_text(content)
+                analysis_cache.link_blob(blob_sha, content_sha)
+                cached_findings = get_cached_findings(content_sha=content_sha)
+                if cached_findings is not None:
+                    cached_files_count += 1
+                    for event in await record_file_result(relative_file_path, cached_findings):
+                        yield event
+                    continue
 
+            # Without triage every whole file goes through the screening model,
+            # if there is one; with it, only the low-risk ones do.
+            screen = bool(SCREENING_MODEL_ID)
+            if TRIAGE_MODE != 'off':
+                risk = await asyncio.to_thread(triage, relative_file_path, content)
+                low_risk = risk.score < TRIAGE_MIN_SCORE
+                # With a screening model, low-risk files are left to it rather than dropped.
+                decision = 'analyze'
+                if low_risk:
+                    decision = 'screen' if SCREENING_MODEL_ID else 'skip'
+                yield sse_event('triage', {
+                    'file': relative_file_path,
+                    'score': risk.score,
+                    'signals': risk.signals,
+                    'decision': decision,
+                })
+                if decision == 'skip':
+                    triaged_out_count += 1
+                    continue
+                screen = decision == 'screen'
+
+            if len(data) > MAX_FILE_SIZE_BYTES:
+                # A line longer than a window (minified or generated code) cannot be split up.
+                if max(estimate_tokens(line) for line in content.splitlines()) > ANALYSIS_WINDOW_TOKENS:
+                    yield sse_event('info', f'Skipping large file with lines too long to analyze (likely minified): {relative_file_path}')
+                    continue
+                windows = split_into_windows(content, ANALYSIS_WINDOW_TOKENS, ANALYSIS_WINDOW_OVERLAP_LINES)
+                items = [
+                    AnalysisItem(relative_file_path, window.text, (window.focus_start, window.focus_end))
+                    for window in windows
+                ]
+                chunked_files[relative_file_path] = {
+                    'windows': len(items), 'results': {}, 'content_sha': content_sha,
+                }
+                yield sse_event('info', f'Analyzing large file in {len(items)} windows: {relative_file_path}')
+            else:
+                item = AnalysisItem(relative_file_path, content, screen=screen)
+                tokens = estimate_tokens(content)
+                if tokens <= BATCH_MAX_FILE_TOKENS:
+                    # Small files wait in the batch until it is full.
+                    if batch and (
+                        len(batch) >= BATCH_MAX_FILES
+                        or sum(estimate_tokens(queued.content) for queued in batch) + tokens > BATCH_TOKEN_BUDGET
+                    ):
+                        async for event in submit(take_batch()):
+                            yield event
+                    batch.append(item)
+                    continue
+                items = [item]
+
+            for item in items:
+                # Windows of a large file are cached on their own, so an edit
+                # elsewhere in the file does not invalidate them.
+                if analysis_cache and item.focus_lines is not None:
+                    cached_findings = get_cached_findings(content_sha=item.content_sha)
+                    if cached_findings is not None:
+                        for event in await finish_item(item, cached_findings):
+                            yield event
+                        continue
+
+                async for event in submit(item):
+                    yield event
+
+        if batch:
+            async for event in submit(take_batch()):
+                yield event
+
+        while pending or retry_queue or unbatched_items:
+            schedule_due_retries()
+            for event in await collect_finished():
+                yield event
+
+        if resumed_files_count:
+            yield sse_event('status', f'{resumed_files_count} file(s) carried over from scan {resume_scan_id}.')
+        if cached_files_count:
+            yield sse_event('status', f'{cached_files_count} file(s) served from the analysis cache.')
+        if triaged_out_count:
+            yield sse_event(
+                'status', f'{triaged_out_count} file(s) skipped by local triage: no risk signals above the threshold.',
+            )
+        if context.screening and context.screening.files:
+            yield sse_event('status', (
+                f'Screening model cleared {context.screening.cleared} of {context.screening.files} file(s) '
+                f'without a full analysis. {context.screening.usage.summary()}'
+            ))
+        yield sse_event('status', context.usage.summary())
+        if unscanned_files or failed_files:
+            not_analyzed = unscanned_files + failed_files
+            yield sse_event('unscanned', {'count': len(not_analyzed), 'files': not_analyzed})
+
+        incomplete = []
+        if unscanned_files:
+            incomplete.append(f'{len(unscanned_files)} file(s) could not be analyzed due to rate limiting')
+        if failed_files:
+            incomplete.append(f'{len(failed_files)} file(s) could not be analyzed because of errors')
+        if partial_files:
+            incomplete.append(f'{len(partial_files)} file(s) could only be partly analyzed')
         if scanned_files_count == 0:
             yield sse_event('status', 'No supported files found to scan in the repository.')
+        elif incomplete:
+            yield sse_event('status', f"Scan incomplete. {'; '.join(incomplete)}.")
         elif not vulnerabilities_found_overall:
             yield sse_event('status', 'Scan complete. No vulnerabilities found in supported files.')
         else:
             yield sse_event('status', 'Scan complete. Vulnerabilities were found.')
+    finally:
+        # The client may disconnect mid-scan; do not leave model calls running.
+        for task in pending:
+            task.cancel()
+
+
+async def stream_scan_events(
+    repo_url: str,
+    access_token: Optional[str],
+    base_ref: Optional[str] = None,
+    head_ref: Optional[str] = None,
+    scan_id: Optional[str] = None,
+    resume_scan_id: Optional[str] = None,
+):
+    repo = None
+    mirror_lease = ExitStack()
+    try:
+        authenticated_repo_url = construct_authenticated_url(repo_url, access_token)
+
+        display_url = repo_url if not access_token else "provided URL (token redacted)"
+        yield sse_event('status', f'Fetching repository from {display_url}...')
+
+        # Git work runs in a worker thread so the event loop is not blocked.
+        # Files are read straight from the mirror's object database, so
+        # nothing is checked out to disk.
+        repository_key = normalize_repository_url(repo_url)
+        await asyncio.to_thread(mirror_lease.enter_context, mirror_cache.in_use(repository_key))
+        repo, base, head = await asyncio.to_thread(
+            fetch_scan_commits, repository_key, authenticated_repo_url, base_ref, head_ref,
+        )
+        yield sse_event('status', 'Repository fetched successfully.')
+
+        changed_paths = None
+        if base:
+            changed_paths = await asyncio.to_thread(list_changed_paths, repo, base, head)
+            yield sse_event(
+                'status',
+                f'Scanning changes between {base[:12]} and {head[:12]}: {len(changed_paths)} file(s) added or modified.',
+            )
+
+        # Scans of the same commits with the same model and prompt share one
+        # run: later ones replay the running scan's events instead of making
+        # their own model calls, and only take over if it stops early.
+        flight_key = (repository_key, base, head, MODEL_ID, SYSTEM_PROMPT_SHA)
+        while (flight := scan_flights.get(flight_key)) is not None:
+            yield sse_event('status', 'An identical scan is already running; sharing its results.')
+            async for event in flight.subscribe():
+                yield event
+            if flight.completed:
+                break
+            yield sse_event('info', 'The shared scan stopped before finishing; continuing on its own.')
+        else:
+            with scan_flights.lead(flight_key) as flight:
+                async with aclosing(scan_files(
+                    repo, repo_url, head, changed_paths, access_token,
+                    scan_id=scan_id, resume_scan_id=resume_scan_id,
+                )) as events:
+                    async for event in events:
+                        flight.publish(event)
+                        yield event
+                flight.completed = True
 
     except Exception as e:
         error_detail = redact_token(f"An unexpected error occurred during scanning: {e}", access_token)
         print(error_detail)
         yield sse_event('critical_error', error_detail)
     finally:
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            yield sse_event('status', 'Cleaned up temporary files.')
+        if analysis_cache:
+            analysis_cache.prune()
+
+        if repo is not None:
+            repo.close()
+        mirror_lease.close()
+        await asyncio.to_thread(mirror_cache.evict)
 
-        yield sse_event('done', 'Process finished.')
+    # Not yielded from the finally block: a generator closed early must not yield.
+    yield sse_event('done', 'Process finished.')
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "model": MODEL_ID}
+    return {
+        "status": "ok",
+        "model": MODEL_ID,
+        "concurrency": analysis_concurrency.snapshot(),
+        "model_tiers": {name: tier.snapshot() for name, tier in model_tiers.items()},
+        "token_budgets": await token_budgets.snapshot(),
+        "regions": bedrock_pool.snapshot(),
+        "cache": analysis_cache.snapshot() if analysis_cache else None,
+    }
+
+
+def check_resumable(request: RepositoryScanRequest) -> None:
+    if not request.resume_scan_id:
+        return
+    job = scan_jobs.store.get(request.resume_scan_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan to resume not found.")
+    if job['repository_url'] != normalize_repository_url(request.repository_url):
+        raise HTTPException(status_code=400, detail="Scan to resume is of a different repository.")
+    if job['status'] in ('queued', 'running'):
+        raise HTTPException(status_code=409, detail="Scan to resume is still running.")
 
 
 @app.post("/scan_repository")
 async def scan_repository_endpoint(request: RepositoryScanRequest):
+    check_resumable(request)
     return StreamingResponse(
-        stream_scan_events(request.repository_url, request.access_token),
+        stream_scan_events(
+            request.repository_url, request.access_token,
+            base_ref=request.base_ref, head_ref=request.head_ref, resume_scan_id=request.resume_scan_id,
+        ),
         media_type="text/event-stream",
     )
 
+
+@app.post("/scans", status_code=202)
+async def create_scan_endpoint(request: RepositoryScanRequest):
+    """Start a scan in the background; its progress is read from /scans/{scan_id}/events."""
+    try:
+        construct_authenticated_url(request.repository_url, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    check_resumable(request)
+    # The access token lives only in the running task; it is never stored.
+    scan_id = scan_jobs.store.create(
+        normalize_repository_url(request.repository_url), request.base_ref, request.head_ref,
+    )
+    scan_jobs.submit(scan_id, stream_scan_events(
+        request.repository_url, request.access_token,
+        base_ref=request.base_ref, head_ref=request.head_ref,
+        scan_id=scan_id, resume_scan_id=request.resume_scan_id,
+    ))
+    return scan_jobs.store.get(scan_id)
+
+
+def get_scan_or_404(scan_id: str) -> dict:
+    job = scan_jobs.store.get(scan_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Scan not found.")
+    return job
+
+
+@app.get("/scans/{scan_id}")
+async def get_scan_endpoint(scan_id: str):
+    return get_scan_or_404(scan_id)
+
+
+@app.get("/scans/{scan_id}/events")
+async def scan_events_endpoint(scan_id: str, last_event_id: Optional[str] = Header(None)):
+    """Stream the scan's events, resuming after Last-Event-ID when a client reconnects."""
+    get_scan_or_404(scan_id)
+    try:
+        after = max(0, int(last_event_id)) if last_event_id else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Last-Event-ID must be an event id from this scan.")
+    return StreamingResponse(scan_jobs.follow(scan_id, after), media_type="text/event-stream")
+
+
+@app.post("/scans/{scan_id}/cancel")
+async def cancel_scan_endpoint(scan_id: str):
+    get_scan_or_404(scan_id)
+    if not scan_jobs.cancel(scan_id):
+        raise HTTPException(status_code=409, detail="Scan is not running in this server process.")
+    return {"scan_id": scan_id, "cancelled": True}
+
 # To run the app (from the 'backend' directory):
 # uvicorn main:app --reload
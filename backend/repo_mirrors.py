@@ -0,0 +1,113 @@
+import fcntl
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+
+from git import Repo
+
+LAST_USED_MARKER = 'scan-last-used'
+FETCH_LOCK = '.scan-lock'
+USE_LOCK = '.use-lock'
+
+
+class MirrorCache:
+    """Bare repositories kept on disk between scans, one per normalized URL.
+
+    Mirrors never store credentials: every fetch is given the authenticated
+    URL explicitly, so a private mirror is only ever refreshed (and used) by
+    a caller whose token can still fetch from the remote. Scans read blobs
+    straight from the mirror while holding a shared lock on it; least
+    recently used mirrors that nobody holds are removed once the cache grows
+    past max_bytes.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def mirror_path(self, repository_key: str) -> str:
+        digest = hashlib.sha256(repository_key.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.root, digest)
+
+    @contextmanager
+    def in_use(self, repository_key: str):
+        """Keep the mirror for repository_key from being evicted while the block runs."""
+        path = self.mirror_path(repository_key)
+        lock_path = os.path.join(path, USE_LOCK)
+        while True:
+            os.makedirs(path, exist_ok=True)
+            lock_file = open(lock_path, 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_SH)
+            # The mirror may have been evicted while we waited for the lock.
+            try:
+                if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+        try:
+            with open(os.path.join(path, LAST_USED_MARKER), 'w'):
+                pass
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    @contextmanager
+    def locked(self, repository_key: str):
+        """Yield the bare mirror for repository_key, holding its fetch lock across processes."""
+        path = self.mirror_path(repository_key)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, FETCH_LOCK), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if not os.path.exists(os.path.join(path, 'HEAD')):
+                    Repo.init(path, bare=True).close()
+                yield path
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def evict(self) -> list:
+        """Remove least recently used mirrors until the cache fits in max_bytes."""
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                mirrors.append((_last_used(path), _disk_usage(path), path))
+
+        total = sum(size for _, size, _ in mirrors)
+        removed = []
+        for _, size, path in sorted(mirrors):
+            if total <= self.max_bytes:
+                break
+            with open(os.path.join(path, USE_LOCK), 'w') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Being read by a running scan; try the next one.
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(path)
+        return removed
+
+
+def _last_used(path: str) -> float:
+    try:
+        return os.path.getmtime(os.path.join(path, LAST_USED_MARKER))
+    except OSError:
+        return 0.0
+
+
+def _disk_usage(path: str) -> int:
+    total = 0
+    for subdir, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                total += os.lstat(os.path.join(subdir, file_name)).st_size
+            except OSError:
+                pass
+    return total
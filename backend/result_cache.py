@@ -0,0 +1,115 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Persistent store of model analyses keyed by content hash, model and prompt.
+
+    Entries expire after ttl_seconds, and the oldest entries are evicted once
+    the store holds more than max_entries. Lookups are a single indexed read,
+    so a hit costs microseconds instead of a model round trip.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS analyses ('
+            ' content_sha TEXT NOT NULL,'
+            ' model_id TEXT NOT NULL,'
+            ' prompt_sha TEXT NOT NULL,'
+            ' result TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' PRIMARY KEY (content_sha, model_id, prompt_sha)'
+            ') WITHOUT ROWID'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS analyses_created_at ON analyses (created_at)')
+        # Git blob SHA -> content hash, so files from a clone can be looked up
+        # from the tree listing without reading them.
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS blobs ('
+            ' blob_sha TEXT PRIMARY KEY,'
+            ' content_sha TEXT NOT NULL'
+            ') WITHOUT ROWID'
+        )
+
+    def get(self, content_sha: str, model_id: str, prompt_sha: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result, created_at FROM analyses'
+                ' WHERE content_sha = ? AND model_id = ? AND prompt_sha = ?',
+                (content_sha, model_id, prompt_sha),
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def get_by_blob(self, blob_sha: str, model_id: str, prompt_sha: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT analyses.result, analyses.created_at FROM blobs'
+                ' JOIN analyses ON analyses.content_sha = blobs.content_sha'
+                ' WHERE blobs.blob_sha = ? AND analyses.model_id = ? AND analyses.prompt_sha = ?',
+                (blob_sha, model_id, prompt_sha),
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def link_blob(self, blob_sha: str, content_sha: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO blobs (blob_sha, content_sha) VALUES (?, ?)',
+                (blob_sha, content_sha),
+            )
+
+    def put(self, content_sha: str, model_id: str, prompt_sha: str, result: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO analyses (content_sha, model_id, prompt_sha, result, created_at)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (content_sha, model_id, prompt_sha, result, time.time()),
+            )
+
+    def prune(self) -> int:
+        """Drop expired entries, then the oldest ones beyond max_entries."""
+        with self._lock:
+            removed = self._conn.execute(
+                'DELETE FROM analyses WHERE created_at < ?', (time.time() - self.ttl_seconds,),
+            ).rowcount
+            cutoff = self._conn.execute(
+                'SELECT created_at FROM analyses ORDER BY created_at DESC LIMIT 1 OFFSET ?',
+                (self.max_entries,),
+            ).fetchone()
+            if cutoff is not None:
+                removed += self._conn.execute(
+                    'DELETE FROM analyses WHERE created_at <= ?', (cutoff[0],),
+                ).rowcount
+            if removed:
+                self._conn.execute(
+                    'DELETE FROM blobs WHERE content_sha NOT IN (SELECT content_sha FROM analyses)'
+                )
+        return removed
+
+    def snapshot(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class ScanJobStore:
+    """SQLite record of background scans and every event they emitted.
+
+    A job's events are appended as they happen, so its progress and findings
+    outlive both the client connection and the process that ran it; only
+    the max_events most recent events of each job are kept. Active jobs are
+    heartbeated by their process; one whose heartbeat stops (the process
+    died or was redeployed) is marked interrupted.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_events: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_events = max_events
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS scans ('
+            ' scan_id TEXT PRIMARY KEY,'
+            ' repository_url TEXT NOT NULL,'
+            ' base_ref TEXT,'
+            ' head_ref TEXT,'
+            ' status TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL'
+            ') WITHOUT ROWID'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS scan_events ('
+            ' scan_id TEXT NOT NULL,'
+            ' seq INTEGER NOT NULL,'
+            ' event TEXT NOT NULL,'
+            ' PRIMARY KEY (scan_id, seq)'
+            ') WITHOUT ROWID'
+        )
+        # Files a job has finished analyzing, so an interrupted job can be resumed.
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS scan_checkpoints ('
+            ' scan_id TEXT NOT NULL,'
+            ' path TEXT NOT NULL,'
+            ' blob_sha TEXT NOT NULL,'
+            ' result TEXT NOT NULL,'
+            ' PRIMARY KEY (scan_id, path)'
+            ') WITHOUT ROWID'
+        )
+
+    def create(self, repository_url: str, base_ref: Optional[str], head_ref: Optional[str]) -> str:
+        scan_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO scans (scan_id, repository_url, base_ref, head_ref, status, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (scan_id, repository_url, base_ref, head_ref, 'queued', now, now),
+            )
+        return scan_id
+
+    def get(self, scan_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT scan_id, repository_url, base_ref, head_ref, status, created_at, updated_at,'
+                ' (SELECT COUNT(*) FROM scan_events WHERE scan_events.scan_id = scans.scan_id)'
+                ' FROM scans WHERE scan_id = ?',
+                (scan_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('scan_id', 'repository_url', 'base_ref', 'head_ref', 'status', 'created_at', 'updated_at',
+                'event_count')
+        return dict(zip(keys, row))
+
+    def set_status(self, scan_id: str, status: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'UPDATE scans SET status = ?, updated_at = ? WHERE scan_id = ?', (status, time.time(), scan_id),
+            )
+
+    def heartbeat(self, scan_ids) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE scans SET updated_at = ? WHERE scan_id = ?', [(now, scan_id) for scan_id in scan_ids],
+            )
+
+    def append_event(self, scan_id: str, seq: int, event: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO scan_events (scan_id, seq, event) VALUES (?, ?, ?)', (scan_id, seq, event),
+            )
+            if seq > self.max_events:
+                self._conn.execute(
+                    'DELETE FROM scan_events WHERE scan_id = ? AND seq <= ?', (scan_id, seq - self.max_events),
+                )
+
+    def events_after(self, scan_id: str, seq: int):
+        """Return (seq, event) for the scan's events after seq, in order."""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT seq, event FROM scan_events WHERE scan_id = ? AND seq > ? ORDER BY seq',
+                (scan_id, seq),
+            ).fetchall()
+
+    def checkpoint(self, scan_id: str, path: str, blob_sha: str, result: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO scan_checkpoints (scan_id, path, blob_sha, result) VALUES (?, ?, ?, ?)',
+                (scan_id, path, blob_sha, result),
+            )
+
+    def checkpoints(self, scan_id: str) -> dict:
+        """Return {path: (blob_sha, result)} for the files the scan has completed."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT path, blob_sha, result FROM scan_checkpoints WHERE scan_id = ?', (scan_id,),
+            ).fetchall()
+        return {path: (blob_sha, result) for path, blob_sha, result in rows}
+
+    def interrupt_stale(self, max_age_seconds: float) -> int:
+        """Mark active jobs whose heartbeat stopped more than max_age_seconds ago as interrupted."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE scans SET status = 'interrupted'"
+                f" WHERE status IN {ACTIVE_STATUSES} AND updated_at < ?",
+                (time.time() - max_age_seconds,),
+            ).rowcount
+
+    def prune(self) -> int:
+        """Drop finished jobs, with their events and checkpoints, older than ttl_seconds."""
+        with self._lock:
+            cutoff = time.time() - self.ttl_seconds
+            for table in ('scan_events', 'scan_checkpoints'):
+                self._conn.execute(
+                    f'DELETE FROM {table} WHERE scan_id IN'
+                    f' (SELECT scan_id FROM scans WHERE updated_at < ? AND status NOT IN {ACTIVE_STATUSES})',
+                    (cutoff,),
+                )
+            return self._conn.execute(
+                f'DELETE FROM scans WHERE updated_at < ? AND status NOT IN {ACTIVE_STATUSES}', (cutoff,),
+            ).rowcount
+
+
+class ScanJobs:
+    """Runs scans as background tasks, independent of any client connection.
+
+    At most max_running scans execute at once; the rest wait as queued.
+    Every event a scan yields is persisted before it is handed to followers,
+    so a client can (re)attach at any time and replay what it missed.
+    """
+
+    def __init__(self, store: ScanJobStore, max_running: int, heartbeat_seconds: float):
+        self.store = store
+        self.heartbeat_seconds = heartbeat_seconds
+        self._slots = asyncio.Semaphore(max_running)
+        self._tasks = {}
+        self._last_seq = {}
+        self._changed = asyncio.Condition()
+        self._heartbeat_task = None
+
+    @property
+    def stale_after_seconds(self) -> float:
+        return self.heartbeat_seconds * 3
+
+    def submit(self, scan_id: str, events) -> None:
+        """Run the async iterator of SSE events for scan_id in the background."""
+        self._tasks[scan_id] = asyncio.create_task(self._run(scan_id, events))
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    def cancel(self, scan_id: str) -> bool:
+        task = self._tasks.get(scan_id)
+        if task is None:
+            return False
+        return task.cancel()
+
+    async def _run(self, scan_id: str, events) -> None:
+        status = 'failed'
+        seq = 0
+        try:
+            async with self._slots:
+                await asyncio.to_thread(self.store.set_status, scan_id, 'running')
+                status = 'completed'
+                async for event in events:
+                    seq += 1
+                    await asyncio.to_thread(self.store.append_event, scan_id, seq, event)
+                    if _event_type(event) == 'critical_error':
+                        status = 'failed'
+                    await self._publish(scan_id, seq)
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        except Exception as e:
+            print(f"Scan job {scan_id} failed: {e}")
+            status = 'failed'
+        finally:
+            # The job must leave the running set whatever happens here, or its
+            # heartbeat keeps it 'running' and followers wait forever.
+            try:
+                try:
+                    await events.aclose()
+                except Exception as e:
+                    print(f"Scan job {scan_id} did not shut down cleanly: {e}")
+                await asyncio.to_thread(self.store.set_status, scan_id, status)
+            finally:
+                self._tasks.pop(scan_id, None)
+                self._last_seq.pop(scan_id, None)
+                async with self._changed:
+                    self._changed.notify_all()
+
+    async def _publish(self, scan_id: str, seq: int) -> None:
+        self._last_seq[scan_id] = seq
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _heartbeat(self) -> None:
+        while self._tasks:
+            await asyncio.to_thread(self.store.heartbeat, list(self._tasks))
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    async def follow(self, scan_id: str, after: int = 0):
+        """Yield the scan's events after seq `after`, then live ones until the job ends.
+
+        Each event carries its seq as the SSE id, so a client that lost the
+        connection reconnects with Last-Event-ID and continues where it left
+        off. Events older than the log's bound are no longer replayed.
+        """
+        while True:
+            for seq, event in await asyncio.to_thread(self.store.events_after, scan_id, after):
+                after = seq
+                yield f"id: {seq}\n{event}"
+
+            if scan_id in self._tasks:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: scan_id not in self._tasks or self._last_seq.get(scan_id, 0) > after
+                    )
+                continue
+
+            # Run by another worker process (or already finished): poll the store.
+            job = await asyncio.to_thread(self.store.get, scan_id)
+            if job is None or job['status'] not in ACTIVE_STATUSES:
+                for seq, event in await asyncio.to_thread(self.store.events_after, scan_id, after):
+                    yield f"id: {seq}\n{event}"
+                return
+            if await asyncio.to_thread(self.store.interrupt_stale, self.stale_after_seconds):
+                continue
+            await asyncio.sleep(1.0)
+
+
+def _event_type(event: str) -> Optional[str]:
+    try:
+        return json.loads(event.partition('data:')[2])['type']
+    except (ValueError, KeyError, TypeError):
+        return None
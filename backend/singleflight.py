@@ -0,0 +1,65 @@
+import asyncio
+from contextlib import contextmanager
+
+
+class Flight:
+    """The events of one running scan, replayed to any number of subscribers.
+
+    Subscribers that attach late first receive every event published so far.
+    completed is set only if the scan ran to the end; a subscriber of a
+    flight that stopped early has to finish the work itself.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.completed = False
+        self._changed = asyncio.Event()
+
+    def publish(self, event) -> None:
+        self.events.append(event)
+        self._notify()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        """Yield every event of the flight, from the first, until it finishes."""
+        position = 0
+        while True:
+            while position < len(self.events):
+                position += 1
+                yield self.events[position - 1]
+            if self.finished:
+                return
+            await self._changed.wait()
+
+
+class ScanFlights:
+    """In-process registry of running scans, so identical scans share one set of model calls."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def get(self, key):
+        return self._flights.get(key)
+
+    @contextmanager
+    def lead(self, key):
+        """Register a new flight for key for the duration of the block."""
+        flight = Flight()
+        self._flights[key] = flight
+        try:
+            yield flight
+        finally:
+            flight.finish()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def __len__(self) -> int:
+        return len(self._flights)
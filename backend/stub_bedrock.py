@@ -0,0 +1,110 @@
+"""Stand-in for the Bedrock Messages API, for running the scanner without AWS.
+
+Every call reports no findings. Start it with
+
+    uvicorn stub_bedrock:app --port 8001
+
+and point the scanner at it with BEDROCK_ENDPOINT_URL=http://127.0.0.1:8001/{region}.
+STUB_LATENCY_SECONDS delays each response, STUB_THROTTLE_RATE is the fraction
+of calls answered with 429, STUB_FAILING_REGIONS lists regions that answer
+every call with 503 and STUB_OVERLOADED_REGIONS regions that answer with 529,
+to exercise throttling and region failover.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from chunking import estimate_tokens
+
+STUB_LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", "0"))
+STUB_THROTTLE_RATE = float(os.getenv("STUB_THROTTLE_RATE", "0"))
+STUB_FAILING_REGIONS = {region.strip() for region in os.getenv("STUB_FAILING_REGIONS", "").split(",") if region.strip()}
+STUB_OVERLOADED_REGIONS = {
+    region.strip() for region in os.getenv("STUB_OVERLOADED_REGIONS", "").split(",") if region.strip()
+}
+
+app = FastAPI(title="Bedrock stub")
+
+
+def error(status_code: int, error_type: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"type": "error", "error": {"type": error_type, "message": message}},
+    )
+
+
+@app.post("/v1/messages")
+@app.post("/{region}/v1/messages")
+async def create_message(request: Request, region: str = ""):
+    body = await request.json()
+    await asyncio.sleep(STUB_LATENCY_SECONDS)
+    if region in STUB_FAILING_REGIONS:
+        return error(503, "api_error", f"Region {region} is unavailable.")
+    if region in STUB_OVERLOADED_REGIONS:
+        return error(529, "overloaded_error", "Overloaded.")
+    if random.random() < STUB_THROTTLE_RATE:
+        return error(429, "rate_limit_error", "Too many requests.")
+
+    tool_names = [tool["name"] for tool in body.get("tools", [])]
+    content = [{"type": "text", "text": "No vulnerabilities found."}]
+    if tool_names:
+        # Every file sent is reviewed and found clean.
+        prompt = body["messages"][-1]["content"]
+        if not isinstance(prompt, str):
+            prompt = "".join(block.get("text", "") for block in prompt)
+        paths = re.findall(r"^File: (.+)$", prompt, re.MULTILINE)
+        tool_input = {"findings": [], "reviewed_files": paths}
+        if tool_names[0] == "report_suspicious_files":
+            tool_input = {"suspicious_files": []}
+        content = [{
+            "type": "tool_use",
+            "id": f"toolu_{uuid.uuid4().hex}",
+            "name": tool_names[0],
+            "input": tool_input,
+        }]
+    message = {
+        "id": f"msg_{uuid.uuid4().hex}",
+        "type": "message",
+        "role": "assistant",
+        "model": body["model"],
+        "content": content,
+        "stop_reason": "tool_use" if tool_names else "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": estimate_tokens(str(body.get("system", "")) + str(body["messages"])),
+                  "output_tokens": 20},
+    }
+    if body.get("stream"):
+        return StreamingResponse(stream_message(message), media_type="text/event-stream")
+    return message
+
+
+def sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps({'type': event_type, **data})}\n\n"
+
+
+async def stream_message(message: dict):
+    """Send message as the event stream of a streamed Messages API call."""
+    yield sse("message_start", {"message": {
+        **message, "content": [], "stop_reason": None, "usage": {**message["usage"], "output_tokens": 0},
+    }})
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "tool_use":
+            yield sse("content_block_start", {"index": index, "content_block": {**block, "input": {}}})
+            yield sse("content_block_delta", {
+                "index": index, "delta": {"type": "input_json_delta", "partial_json": json.dumps(block["input"])},
+            })
+        else:
+            yield sse("content_block_start", {"index": index, "content_block": {**block, "text": ""}})
+            yield sse("content_block_delta", {"index": index, "delta": {"type": "text_delta", "text": block["text"]}})
+        yield sse("content_block_stop", {"index": index})
+    yield sse("message_delta", {
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    })
+    yield sse("message_stop", {})
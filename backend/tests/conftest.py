@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+# main reads its configuration when it is imported, so the tests' settings
+# must be in place first. Stores go to a scratch directory, and the analysis
+# cache is off so that repeated scans make their model calls again.
+_scratch = tempfile.mkdtemp(prefix='code-security-scanner-tests-')
+os.environ.update({
+    'AWS_REGION': 'us-east-1',
+    'ANALYSIS_CACHE_PATH': '',
+    'RATE_LIMIT_STATE_PATH': '',
+    'MIRROR_CACHE_DIR': os.path.join(_scratch, 'mirrors'),
+    'SCAN_JOBS_PATH': os.path.join(_scratch, 'scan_jobs.sqlite3'),
+    'BEDROCK_SCREENING_MODEL_ID': '',
+    'TRIAGE_MODE': 'off',
+    'STREAM_FINDINGS': 'false',
+    'TOKENS_PER_MINUTE': '0',
+    'REQUESTS_PER_MINUTE': '0',
+})
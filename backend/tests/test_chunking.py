@@ -0,0 +1,53 @@
+from chunking import estimate_tokens, split_into_windows
+
+
+def focus_text(window):
+    """The window's own lines, without line numbers or overlap context."""
+    lines = window.text.split('\n')
+    numbered = {int(line.partition('|')[0]): line.partition('| ')[2] for line in lines}
+    return [numbered[number] for number in range(window.focus_start, window.focus_end + 1)]
+
+
+def test_small_content_is_one_window():
+    windows = split_into_windows('a = 1\nb = 2\n', max_tokens=1000, overlap_lines=5)
+    assert [(window.focus_start, window.focus_end) for window in windows] == [(1, 2)]
+    assert windows[0].text == '1| a = 1\n2| b = 2'
+
+
+def test_windows_cover_every_line_once():
+    lines = [f'value_{number} = {number}' for number in range(1, 101)]
+    windows = split_into_windows('\n'.join(lines), max_tokens=50, overlap_lines=3)
+    assert len(windows) > 1
+    assert windows[0].focus_start == 1
+    assert windows[-1].focus_end == 100
+    for previous, window in zip(windows, windows[1:]):
+        assert window.focus_start == previous.focus_end + 1
+    assert [line for window in windows for line in focus_text(window)] == lines
+
+
+def test_windows_respect_the_token_budget():
+    lines = [f'value_{number} = {number}' for number in range(1, 101)]
+    for window in split_into_windows('\n'.join(lines), max_tokens=50, overlap_lines=0):
+        assert sum(estimate_tokens(line) for line in focus_text(window)) <= 50
+
+
+def test_overlap_lines_are_included_as_context():
+    lines = [f'line {number}' for number in range(1, 31)]
+    windows = split_into_windows('\n'.join(lines), max_tokens=20, overlap_lines=2)
+    second = windows[1]
+    numbers = [int(line.partition('|')[0]) for line in second.text.split('\n')]
+    assert numbers[0] == second.focus_start - 2
+    assert numbers[-1] == second.focus_end + 2
+
+
+def test_line_numbers_are_padded_to_the_same_width():
+    lines = [f'x{number}' for number in range(1, 12)]
+    text = split_into_windows('\n'.join(lines), max_tokens=1000, overlap_lines=0)[0].text.split('\n')
+    assert text[0] == ' 1| x1'
+    assert text[-1] == '11| x11'
+
+
+def test_a_line_over_the_budget_gets_a_window_of_its_own():
+    content = 'short\n' + 'x' * 400 + '\nshort again'
+    windows = split_into_windows(content, max_tokens=10, overlap_lines=0)
+    assert [(window.focus_start, window.focus_end) for window in windows] == [(1, 1), (2, 2), (3, 3)]
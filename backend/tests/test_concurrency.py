@@ -0,0 +1,208 @@
+import asyncio
+import time
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from concurrency import (
+    AdaptiveConcurrency, RetryQueue, SharedBudgetStore, SharedTokenBucket, TokenBucket, TokenBudgets,
+    parse_model_limits, parse_retry_after,
+)
+
+
+def test_parse_retry_after_prefers_milliseconds():
+    assert parse_retry_after({'retry-after-ms': '1500', 'retry-after': '9'}) == 1.5
+
+
+def test_parse_retry_after_seconds_and_dates():
+    assert parse_retry_after({'retry-after': '3'}) == 3.0
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after({'retry-after': format_datetime(retry_at, usegmt=True)}) <= 30
+
+
+def test_parse_retry_after_ignores_unusable_hints():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after({}) is None
+    assert parse_retry_after({'retry-after': 'soon'}) is None
+    assert parse_retry_after({'retry-after-ms': 'soon'}) is None
+    assert parse_retry_after({'retry-after': '-5'}) == 0.0
+
+
+def test_window_grows_on_success_and_halves_on_throttle():
+    limiter = AdaptiveConcurrency(initial=4, minimum=1, maximum=8)
+
+    async def run():
+        # About one slot more per window's worth of successful calls.
+        for _ in range(5):
+            limiter.release(await limiter.acquire())
+        assert limiter.window == 5
+        limiter.release(await limiter.acquire(), throttled=True)
+        assert limiter.window == 2
+
+    asyncio.run(run())
+
+
+def test_throttles_from_one_epoch_cut_the_window_once():
+    limiter = AdaptiveConcurrency(initial=8, minimum=1, maximum=8)
+
+    async def run():
+        epochs = [await limiter.acquire() for _ in range(3)]
+        for epoch in epochs:
+            limiter.release(epoch, throttled=True)
+        assert limiter.window == 4
+        assert limiter.throttle_count == 3
+
+    asyncio.run(run())
+
+
+def test_window_stays_within_bounds():
+    limiter = AdaptiveConcurrency(initial=2, minimum=2, maximum=3)
+
+    async def run():
+        for _ in range(20):
+            limiter.release(await limiter.acquire())
+        assert limiter.window == 3
+        for _ in range(5):
+            limiter.release(await limiter.acquire(), throttled=True)
+        assert limiter.window == 2
+
+    asyncio.run(run())
+
+
+def test_acquire_waits_for_a_free_slot():
+    limiter = AdaptiveConcurrency(initial=1, minimum=1, maximum=1)
+
+    async def run():
+        epoch = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert limiter.snapshot()['waiting'] == 1
+        limiter.release(epoch)
+        limiter.release(await asyncio.wait_for(waiter, 1))
+        assert limiter.in_flight == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_does_not_keep_a_slot():
+    limiter = AdaptiveConcurrency(initial=1, minimum=1, maximum=1)
+
+    async def run():
+        epoch = await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release(epoch)
+        assert limiter.in_flight == 0
+        limiter.release(await asyncio.wait_for(limiter.acquire(), 1))
+
+    asyncio.run(run())
+
+
+def test_retry_delay_uses_jittered_exponential_backoff():
+    queue = RetryQueue(base_delay=1.0, max_delay=8.0)
+    for attempt, backoff in ((1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (10, 8.0)):
+        assert backoff / 2 <= queue.push('item', attempt) <= backoff
+
+
+def test_retry_after_is_a_lower_bound_capped_at_max_delay():
+    queue = RetryQueue(base_delay=1.0, max_delay=8.0)
+    assert queue.push('item', 1, retry_after=5.0) == 5.0
+    assert queue.push('item', 1, retry_after=60.0) == 8.0
+    assert queue.push('item', 4, retry_after=0.0) >= 4.0
+
+
+def test_retry_queue_releases_items_once_due():
+    queue = RetryQueue(base_delay=0.02, max_delay=0.02)
+    assert queue.seconds_until_due() is None
+    assert queue.pop_due() is None
+    queue.push('first', 1, retry_after=0.02)
+    queue.push('second', 1, retry_after=0.02)
+    assert len(queue) == 2
+    assert queue.pop_due() is None
+    assert 0 < queue.seconds_until_due() <= 0.02
+    time.sleep(0.03)
+    assert [queue.pop_due(), queue.pop_due(), queue.pop_due()] == ['first', 'second', None]
+
+
+def test_token_bucket_reserves_and_refunds():
+    bucket = TokenBucket(tokens_per_minute=600)
+
+    async def run():
+        assert await bucket.acquire(500) == 500
+        assert (await bucket.snapshot())['available'] <= 100
+        await bucket.settle(500, 200)
+        assert (await bucket.snapshot())['available'] >= 400
+
+    asyncio.run(run())
+
+
+def test_token_bucket_limits_reservations_to_a_minute_of_tokens():
+    bucket = TokenBucket(tokens_per_minute=600)
+    assert asyncio.run(bucket.acquire(10_000)) == 600
+
+
+def test_token_bucket_waiter_is_woken_by_a_refund():
+    # At 60 tokens a minute the waiter would need 30 s to be served by the refill.
+    bucket = TokenBucket(tokens_per_minute=60)
+
+    async def run():
+        reserved = await bucket.acquire(60)
+        waiter = asyncio.create_task(bucket.acquire(30))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert bucket.waiting == 1
+        await bucket.settle(reserved, 10)
+        assert await asyncio.wait_for(waiter, 1) == 30
+
+    asyncio.run(run())
+
+
+def test_shared_buckets_draw_from_one_balance(tmp_path):
+    path = str(tmp_path / 'budgets.sqlite3')
+    first = SharedTokenBucket(SharedBudgetStore(path), 'model', tokens_per_minute=6000)
+    second = SharedTokenBucket(SharedBudgetStore(path), 'model', tokens_per_minute=6000)
+
+    async def run():
+        await first.acquire(5000)
+        assert (await second.snapshot())['available'] < 1100
+        await first.settle(5000, 1000)
+        assert (await second.snapshot())['available'] >= 5000
+
+    asyncio.run(run())
+
+
+def test_shared_bucket_waits_for_tokens_taken_elsewhere(tmp_path):
+    path = str(tmp_path / 'budgets.sqlite3')
+    first = SharedTokenBucket(SharedBudgetStore(path), 'model', tokens_per_minute=60)
+    second = SharedTokenBucket(SharedBudgetStore(path), 'model', tokens_per_minute=60)
+
+    async def run():
+        await first.acquire(60)
+        waiter = asyncio.create_task(second.acquire(30))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        # Another process's refund is noticed by polling the store.
+        await first.settle(60, 0)
+        assert await asyncio.wait_for(waiter, 2) == 30
+
+    asyncio.run(run())
+
+
+def test_token_budgets_only_limit_configured_models():
+    budgets = TokenBudgets(0, {'limited': 1000}, requests_per_minute=0)
+    assert budgets.bucket('unlimited') is None
+    assert budgets.requests('limited') is None
+    assert isinstance(budgets.bucket('limited'), TokenBucket)
+    assert budgets.bucket('limited') is budgets.bucket('limited')
+
+
+def test_parse_model_limits():
+    assert parse_model_limits('') == {}
+    assert parse_model_limits(' a.model-v1:0=400000, b=200000 ,') == {'a.model-v1:0': 400000, 'b': 200000}
+    with pytest.raises(ValueError):
+        parse_model_limits('no-limit')
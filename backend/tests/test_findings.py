@@ -0,0 +1,34 @@
+from main import Finding, merge_window_findings
+
+
+def finding(line, description='SQL built from request input', cwe='CWE-89'):
+    return Finding(file='app.py', line=line, cwe=cwe, severity='High', description=description, fix='Bind parameters.')
+
+
+def test_duplicates_from_overlapping_windows_are_dropped():
+    merged = merge_window_findings({
+        (1, 100): [finding(98)],
+        (101, 200): [finding(98), finding(150)],
+    })
+    assert [item.line for item in merged] == [98, 150]
+
+
+def test_findings_within_one_window_are_all_kept():
+    merged = merge_window_findings({(1, 100): [finding(10), finding(10)]})
+    assert len(merged) == 2
+
+
+def test_different_issues_on_one_line_are_kept():
+    merged = merge_window_findings({
+        (1, 100): [finding(98)],
+        (101, 200): [finding(98, description='Path built from request input', cwe='CWE-22')],
+    })
+    assert len(merged) == 2
+
+
+def test_failed_windows_are_left_out_and_findings_sorted_by_line():
+    merged = merge_window_findings({
+        (101, 200): [finding(150), finding(None)],
+        (1, 100): [finding(20)],
+    })
+    assert [item.line for item in merged] == [None, 20, 150]
@@ -0,0 +1,136 @@
+"""Scans of a local repository against the Bedrock stub in stub_bedrock.py.
+
+The stub runs in-process behind an ASGI transport, with its throttling and
+region failures switched on per test.
+"""
+import asyncio
+import itertools
+import json
+import types
+
+import anthropic
+import httpx2
+import pytest
+from anthropic import AsyncAnthropicBedrockMantle
+from git import Actor, Repo
+
+import main
+import stub_bedrock
+from bedrock_pool import BedrockPool
+
+AUTHOR = Actor('Test', 'test@example.com')
+
+
+def stub_client(region: str) -> AsyncAnthropicBedrockMantle:
+    return AsyncAnthropicBedrockMantle(
+        aws_region=region,
+        base_url=f'http://stub/{region}/',
+        skip_auth=True,
+        max_retries=0,
+        http_client=anthropic.DefaultAsyncHttpxClient(transport=httpx2.ASGITransport(app=stub_bedrock.app)),
+    )
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def use_regions(*regions):
+        bedrock_pool = BedrockPool({region: stub_client(region) for region in regions})
+        monkeypatch.setattr(main, 'bedrock_pool', bedrock_pool)
+        return bedrock_pool
+    return use_regions
+
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    """A repository of three small files, fetched through a file:// URL."""
+    path = tmp_path / 'repository'
+    repo = Repo.init(path)
+    (path / 'sub').mkdir()
+    (path / 'app.py').write_text('from flask import request\n\nname = request.args["name"]\n')
+    (path / 'util.py').write_text('def add(a, b):\n    return a + b\n')
+    (path / 'sub' / 'auth.py').write_text('def check(password):\n    return password == "secret"\n')
+    repo.index.add(['app.py', 'util.py', 'sub/auth.py'])
+    repo.index.commit('Initial commit', author=AUTHOR, committer=AUTHOR)
+    monkeypatch.setattr(main, 'construct_authenticated_url', lambda repo_url, access_token: path.as_uri())
+    monkeypatch.setattr(main, 'RETRY_BASE_DELAY_SECONDS', 0.01)
+    # Each test gets its own mirror.
+    repo.scan_url = f'https://example.com/{tmp_path.name}.git'
+    return repo
+
+
+def scan(repo_url: str, **kwargs) -> list:
+    async def collect():
+        return [
+            json.loads(event.partition('data: ')[2])
+            async for event in main.stream_scan_events(repo_url, None, **kwargs)
+        ]
+    return asyncio.run(collect())
+
+
+def statuses(events) -> list:
+    return [event['payload'] for event in events if event['type'] == 'status']
+
+
+def test_scan_reports_every_file(repository, pool):
+    bedrock_pool = pool('us-east-1')
+    events = scan(repository.scan_url)
+    assert statuses(events)[-1] == 'Scan complete. No vulnerabilities found in supported files.'
+    clean = {event['payload'] for event in events if event['type'] == 'info' and 'No vulnerabilities' in event['payload']}
+    assert len(clean) == 3
+    assert bedrock_pool.snapshot()['us-east-1']['calls'] == 1
+
+
+def test_throttled_calls_are_retried(repository, pool, monkeypatch):
+    bedrock_pool = pool('us-east-1')
+    # The first two calls are throttled, every later one succeeds.
+    draws = itertools.chain([0.0, 0.0], itertools.repeat(1.0))
+    monkeypatch.setattr(stub_bedrock, 'STUB_THROTTLE_RATE', 0.5)
+    monkeypatch.setattr(stub_bedrock, 'random', types.SimpleNamespace(random=lambda: next(draws)))
+    throttles_before = main.analysis_concurrency.throttle_count
+
+    events = scan(repository.scan_url)
+
+    retries = [event for event in events if event['type'] == 'info' and 'Rate limited' in event['payload']]
+    assert len(retries) == 2
+    assert main.analysis_concurrency.throttle_count - throttles_before == 2
+    assert bedrock_pool.snapshot()['us-east-1']['throttles'] == 2
+    assert statuses(events)[-1] == 'Scan complete. No vulnerabilities found in supported files.'
+
+
+@pytest.mark.parametrize('failure', ['STUB_FAILING_REGIONS', 'STUB_OVERLOADED_REGIONS'])
+def test_failing_region_is_failed_over(repository, pool, monkeypatch, failure):
+    bedrock_pool = pool('us-east-1', 'us-west-2')
+    monkeypatch.setattr(stub_bedrock, failure, {'us-east-1'})
+
+    events = scan(repository.scan_url)
+
+    regions = bedrock_pool.snapshot()
+    assert regions['us-east-1']['errors'] == 1
+    assert regions['us-east-1']['cooling_down']
+    assert regions['us-west-2']['calls'] == 1
+    assert not [event for event in events if event['type'] == 'error']
+    assert statuses(events)[-1] == 'Scan complete. No vulnerabilities found in supported files.'
+
+
+def test_resumed_scan_only_analyzes_changed_files(repository, pool, monkeypatch):
+    bedrock_pool = pool('us-east-1')
+    # One file per call, so the number of calls is the number of files analyzed.
+    monkeypatch.setattr(main, 'BATCH_MAX_FILE_TOKENS', 0)
+    repository_url = main.normalize_repository_url(repository.scan_url)
+    first_scan = main.scan_jobs.store.create(repository_url, None, None)
+    scan(repository.scan_url, scan_id=first_scan)
+    assert bedrock_pool.snapshot()['us-east-1']['calls'] == 3
+    assert len(main.scan_jobs.store.checkpoints(first_scan)) == 3
+
+    path = repository.working_tree_dir
+    with open(f'{path}/util.py', 'a') as file:
+        file.write('\n\ndef subtract(a, b):\n    return a - b\n')
+    repository.index.add(['util.py'])
+    repository.index.commit('Add subtract', author=AUTHOR, committer=AUTHOR)
+
+    second_scan = main.scan_jobs.store.create(repository_url, None, None)
+    events = scan(repository.scan_url, scan_id=second_scan, resume_scan_id=first_scan)
+
+    assert bedrock_pool.snapshot()['us-east-1']['calls'] == 4
+    assert f'2 file(s) carried over from scan {first_scan}.' in statuses(events)
+    assert statuses(events)[-1] == 'Scan complete. No vulnerabilities found in supported files.'
@@ -0,0 +1,56 @@
+from triage import path_priority, triage
+
+
+def test_data_files_score_zero():
+    result = triage('config/colors.py', "PRIMARY = '#336699'\nSECONDARY = '#ffffff'\n")
+    assert result.score == 0
+    assert result.signals == {}
+
+
+def test_sinks_and_sources_are_counted():
+    content = (
+        'import subprocess\n'
+        'from flask import request\n'
+        '\n'
+        '@app.route("/run")\n'
+        'def run():\n'
+        '    subprocess.run(request.args["cmd"], shell=True)\n'
+    )
+    signals = triage('app.py', content).signals
+    assert signals['command-exec'] >= 1
+    assert signals['entry-point'] == 1
+
+
+def test_python_sinks_are_found_through_aliases():
+    signals = triage('tools.py', 'import os as operating_system\noperating_system.system(cmd)\n').signals
+    assert signals['command-exec'] >= 1
+
+
+def test_entry_point_signal_ignores_everyday_code():
+    content = 'settings = options.get("main")\nmaintainer = route_name\n'
+    assert 'entry-point' not in triage('util.py', content).signals
+
+
+def test_entry_points_in_several_languages():
+    for relative_file_path, content in (
+        ('cli.py', 'if __name__ == "__main__":\n    run()\n'),
+        ('server.js', 'router.get("/", handler)\napp.listen(3000)\n'),
+        ('main.go', 'func main() {\n\thttp.HandleFunc("/", handler)\n}\n'),
+        ('Api.java', '@RestController\nclass Api {\n  @GetMapping("/")\n  String index() {}\n}\n'),
+    ):
+        assert 'entry-point' in triage(relative_file_path, content).signals, relative_file_path
+
+
+def test_risky_paths_go_first():
+    assert path_priority('src/auth/login.py') > path_priority('src/utils/strings.py')
+    assert path_priority('api/controllers/users.py') > path_priority('api/models.py')
+
+
+def test_entry_point_file_names_go_before_plain_modules():
+    assert path_priority('server.js') > path_priority('colors.js')
+
+
+def test_tests_and_docs_go_last():
+    assert path_priority('tests/auth/test_login.py') < path_priority('lib/strings.py')
+    assert path_priority('test_views.py') < path_priority('views.py')
+    assert path_priority('docs/examples/app.py') < path_priority('app.py')
@@ -0,0 +1,219 @@
+import ast
+import re
+from collections import Counter
+from typing import Dict, NamedTuple
+
+# Signals of security-relevant code, matched anywhere in a file of any of
+# the supported languages. Each is (name, weight, triggers, pattern); a file's
+# score is the weighted number of matches, counting at most
+# MAX_COUNT_PER_SIGNAL of each. A pattern only runs if one of its lowercase
+# trigger substrings occurs in the file, which keeps triage of data files and
+# plain code to a few substring searches.
+SIGNALS = [
+    ('code-eval', 3,
+     ('eval', 'exec', 'function', 'settimeout'),
+     r'\b(eval|exec|execfile)\s*\(|\bnew\s+Function\s*\(|\bsetTimeout\s*\(\s*["\']|\bcreate_function\s*\('),
+    ('command-exec', 3,
+     ('subprocess', 'os.', 'child_process', 'execsync', 'runtime', 'processbuilder', 'command', 'shell_exec',
+      'passthru', 'proc_open', 'popen', 'system', 'process.start'),
+     r'\bsubprocess\.|\bos\.(system|popen|exec\w*|spawn\w*)\s*\(|\bchild_process\b|\bexecSync\s*\('
+     r'|\bRuntime\.getRuntime\(\)\.exec|\bProcessBuilder\b|\bexec\.Command\s*\('
+     r'|\b(shell_exec|passthru|proc_open|popen|system)\s*\(|\bProcess\.Start\s*\('),
+    ('sql-building', 3,
+     ('select', 'insert', 'update', 'delete', 'execute', 'query', 'raw', 'exec'),
+     r'(?i:\b(select\s[^;\n]{0,120}?\sfrom|insert\s+into|update\s+\w+\s+set|delete\s+from)\b[^;\n]{0,200}?'
+     r'(["\']\s*(\+|\.|%)|\$\{|\{\w*\}|%s|\.format\s*\(|\$\w+))'
+     r'|\.(execute|executemany|query|raw|rawQuery|exec)\s*\(\s*(f["\']|["\'][^"\'\n]*["\']\s*(\+|%|\.format))'),
+    ('deserialization', 3,
+     ('pickle', 'marshal', 'shelve', 'dill', 'yaml', 'objectinputstream', 'unserialize', 'binaryformatter',
+      'jsonpickle', 'xmldecoder'),
+     r'\b(pickle|cPickle|marshal|shelve|dill)\.loads?\s*\(|\byaml\.(unsafe_)?load\s*\(|\bObjectInputStream\b'
+     r'|\bunserialize\s*\(|\bBinaryFormatter\b|\bMarshal\.load\b|\bjsonpickle\.decode\b|\bXMLDecoder\b'),
+    ('template-injection', 3,
+     ('render_template_string', 'template'),
+     r'\brender_template_string\s*\(|\bTemplate\s*\(\s*request\b'),
+    ('xss-sink', 2,
+     ('innerhtml', 'outerhtml', 'document.write', 'safe', 'v-html', 'echo'),
+     r'\.(innerHTML|outerHTML)\s*=|dangerouslySetInnerHTML|document\.write\s*\(|\|\s*safe\b|\bmark_safe\s*\('
+     r'|\bv-html\b|\.html_safe\b|\becho\s+\$_(GET|POST|REQUEST)'),
+    ('hardcoded-secret', 3,
+     ('password', 'passwd', 'secret', 'key', 'token', 'akia'),
+     r'(?i:(password|passwd|secret|api_?key|access_?key|private_?key|auth_?token)\w*["\']?\s*[:=]\s*'
+     r'["\'][^"\'\s]{6,}["\'])|\bAKIA[0-9A-Z]{16}\b|-----BEGIN (RSA |EC |DSA )?PRIVATE KEY'),
+    ('unsafe-config', 2,
+     ('verify', 'debug', 'rejectunauthorized', 'insecureskipverify', 'shell', 'access-control-allow-origin'),
+     r'\bverify\s*=\s*False\b|\bDEBUG\s*=\s*True\b|rejectUnauthorized\s*:\s*false'
+     r'|InsecureSkipVerify\s*:\s*true|\bshell\s*=\s*True\b|Access-Control-Allow-Origin["\']?\s*[,:]\s*["\']\*'),
+    ('weak-crypto', 2,
+     ('md5', 'sha1', 'des', 'rc4', 'ecb', 'math.random'),
+     r'\b(md5|MD5|sha1|SHA1)\s*\(|\bhashlib\.(md5|sha1)\b|\bDES(ede)?\b|\bRC4\b|/ECB/|\bMODE_ECB\b'
+     r'|\bMath\.random\s*\('),
+    ('memory-unsafe', 2,
+     ('strcpy', 'strcat', 'sprintf', 'gets', 'scanf', 'alloca', 'memcpy', 'memmove'),
+     r'\b(strcpy|strcat|sprintf|vsprintf|gets|scanf|alloca|memcpy|memmove)\s*\('),
+    ('format-string', 2,
+     ('printf', 'syslog'),
+     r'\b(printf|vprintf)\s*\(\s*[A-Za-z_][\w.\->\[\]]*\s*[,)]'
+     r'|\b(fprintf|dprintf|syslog|vfprintf)\s*\(\s*\w+\s*,\s*[A-Za-z_][\w.\->\[\]]*\s*[,)]'),
+    ('xml-parsing', 1,
+     ('factory', 'xmlreader', 'xmldocument', 'etree', 'xml.dom', 'libxml', 'simplexml_load_'),
+     r'\b(DocumentBuilderFactory|SAXParserFactory|XMLInputFactory|XmlReader|XmlDocument|etree\.(parse|fromstring)'
+     r'|xml\.dom|libxml\w*|simplexml_load_\w+)\b'),
+    ('file-access', 1,
+     ('file', 'fopen', 'include_once', 'require_once', 'os.path.join'),
+     r'\b(readFile|readFileSync|writeFile|createReadStream|sendFile|send_file|file_get_contents|fopen'
+     r'|include_once|require_once|os\.path\.join|ServeFile|ReadFile|os\.Open(File)?)\s*\('
+     r'|\bnew\s+File(InputStream|Reader)?\s*\('),
+    ('network-request', 1,
+     ('requests', 'httpx', 'urlopen', 'fetch', 'axios', 'curl_exec', 'httpclient', 'http.get', 'http.post',
+      'resttemplate'),
+     r'\b(requests|httpx)\.(get|post|put|delete|request)\s*\(|\burlopen\s*\(|\bfetch\s*\(|\baxios\b'
+     r'|\bcurl_exec\s*\(|\bHttpClient\b|\bhttp\.(Get|Post)\s*\(|\bRestTemplate\b'),
+    ('redirect', 1,
+     ('redirect', 'location'),
+     r'\b(redirect|sendRedirect|res\.redirect|header\s*\(\s*["\']Location)\b'),
+    ('user-input', 1,
+     ('request', 'req.', '$_', 'pathvariable', 'getparameter', 'c.query', 'c.param', 'c.postform', 'params[',
+      'argv', 'input', 'url.query', 'formvalue', 'header.get', 'mux.vars', 'r.body', 'getenv'),
+     r'\brequest\.(args|form|values|json|GET|POST|FILES|COOKIES|cookies|headers|query_params|data|body|params)\b'
+     r'|\breq\.(body|query|params|cookies|headers)\b|\$_(GET|POST|REQUEST|COOKIE|FILES|SERVER)\b'
+     r'|@(RequestParam|PathVariable|RequestBody)\b|\bgetParameter\s*\(|\bc\.(Query|Param|PostForm)\s*\('
+     r'|\bparams\[|\bargv\b|\binput\s*\(|\.URL\.Query\(\)|\.(Post)?FormValue\s*\(|\.Header\.Get\s*\('
+     r'|\bmux\.Vars\s*\(|\br\.Body\b|\bgetenv\s*\('),
+    ('auth-logic', 1,
+     ('jwt', 'password', 'authenticate', 'authorize', 'csrf', 'bcrypt', 'cookie'),
+     r'(?i:\b(jwt|verify_password|check_password|authenticate|authorize|csrf|bcrypt|set_cookie|setcookie)\b)'),
+    ('entry-point', 1,
+     ('__main__', '@app.', '@router.', '@bp.', '@blueprint.', '@api.', 'app.listen', 'router.', 'handlefunc',
+      '@controller', '@restcontroller', '@getmapping', '@postmapping', '@putmapping', '@deletemapping',
+      '@requestmapping', 'func main', 'void main', 'int main'),
+     r'__name__\s*==\s*["\']__main__["\']|@(app|router|bp|blueprint|api)\.(route|get|post|put|delete|patch)\s*\('
+     r'|\bapp\.listen\s*\(|\brouter\.(get|post|put|delete|patch|use)\s*\(|\bhttp\.HandleFunc\s*\('
+     r'|@(Rest)?Controller\b|@(Get|Post|Put|Delete|Request)Mapping\b|\bfunc main\s*\('
+     r'|\bstatic void main\s*\(|\bint main\s*\('),
+]
+MAX_COUNT_PER_SIGNAL = 3
+
+_SIGNAL_WEIGHTS = {name: weight for name, weight, _, _ in SIGNALS}
+_SIGNAL_PATTERNS = [(name, triggers, re.compile(pattern)) for name, _, triggers, pattern in SIGNALS]
+
+# Path components that suggest security-sensitive code, and those that
+# suggest code nobody deploys.
+RISKY_PATH_HINTS = {
+    'auth', 'login', 'session', 'password', 'token', 'oauth', 'sso', 'api', 'controller', 'controllers',
+    'route', 'routes', 'router', 'handler', 'handlers', 'view', 'views', 'middleware', 'admin', 'upload',
+    'uploads', 'payment', 'payments', 'billing', 'account', 'accounts', 'user', 'users', 'security', 'crypto',
+}
+LOW_RISK_PATH_HINTS = {'test', 'tests', 'spec', 'specs', '__tests__', 'fixtures', 'mocks', 'examples', 'docs'}
+ENTRY_POINT_NAMES = {
+    'main', 'app', 'server', 'index', 'manage', 'wsgi', 'asgi', 'urls', 'routes', 'program', 'startup',
+}
+
+_PYTHON_SINKS = {
+    'eval': 'code-eval', 'exec': 'code-eval', 'compile': 'code-eval', '__import__': 'code-eval',
+    'os.system': 'command-exec', 'os.popen': 'command-exec',
+    'pickle.loads': 'deserialization', 'pickle.load': 'deserialization', 'marshal.loads': 'deserialization',
+    'shelve.open': 'deserialization', 'yaml.unsafe_load': 'deserialization',
+    'hashlib.md5': 'weak-crypto', 'hashlib.sha1': 'weak-crypto',
+}
+_SQL_METHODS = {'execute', 'executemany', 'executescript', 'raw', 'extra'}
+
+
+class TriageResult(NamedTuple):
+    score: int
+    signals: Dict[str, int]
+
+
+def triage(relative_file_path: str, content: str) -> TriageResult:
+    """Score how likely a file is to contain a vulnerability, from local signals alone.
+
+    A score of 0 means none of the sinks, sources or risky configurations
+    above appear in the file, as for pure data, constants or styling. Python
+    files are also parsed, which catches sinks the patterns miss (for
+    example calls through aliased imports).
+    """
+    lowered = content.lower()
+    signals = Counter()
+    for name, triggers, pattern in _SIGNAL_PATTERNS:
+        if any(trigger in lowered for trigger in triggers):
+            count = sum(1 for _ in pattern.finditer(content))
+            if count:
+                signals[name] = count
+    if relative_file_path.endswith('.py'):
+        for name, count in Counter(_python_signals(content)).items():
+            signals[name] = max(signals[name], count)
+
+    score = sum(_SIGNAL_WEIGHTS[name] * min(count, MAX_COUNT_PER_SIGNAL) for name, count in signals.items())
+    return TriageResult(score, dict(signals))
+
+
+def path_priority(relative_file_path: str) -> float:
+    """Cheap estimate of how urgently a file should be analyzed; higher goes first.
+
+    Uses the path alone (auth, api, controllers, ..., entry-point file
+    names such as main or server, and test or docs directories), so a
+    whole tree can be ordered without reading a single file.
+    """
+    *dir_names, file_name = relative_file_path.lower().split('/')
+    stem = file_name.rpartition('.')[0]
+    words = set(re.split(r'[^a-z0-9_]+', '/'.join(dir_names + [stem])))
+
+    priority = 5.0 * min(2, len(words & RISKY_PATH_HINTS))
+    if stem in ENTRY_POINT_NAMES:
+        priority += 5
+    if words & LOW_RISK_PATH_HINTS or file_name.startswith('test_'):
+        priority -= 10
+    return priority
+
+
+def _python_signals(content: str):
+    """Yield a signal name for each sink call found in Python source that parses."""
+    try:
+        tree = ast.parse(content)
+    except (SyntaxError, ValueError):
+        return
+    # Map local names to what they were imported as: "import subprocess as sp"
+    # and "from os import system" resolve to subprocess and os.system.
+    aliases = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = alias.name
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = f'{node.module}.{alias.name}'
+
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = _call_name(node.func)
+        head, _, rest = name.partition('.')
+        if head in aliases:
+            name = f'{aliases[head]}.{rest}' if rest else aliases[head]
+        if name in _PYTHON_SINKS:
+            yield _PYTHON_SINKS[name]
+        elif name.startswith('subprocess.'):
+            yield 'command-exec'
+        elif name == 'yaml.load' and not any(keyword.arg == 'Loader' for keyword in node.keywords):
+            yield 'deserialization'
+        elif name.rpartition('.')[2] in _SQL_METHODS and node.args and _is_built_string(node.args[0]):
+            yield 'sql-building'
+
+
+def _call_name(func) -> str:
+    parts = []
+    while isinstance(func, ast.Attribute):
+        parts.append(func.attr)
+        func = func.value
+    if isinstance(func, ast.Name):
+        parts.append(func.id)
+    return '.'.join(reversed(parts))
+
+
+def _is_built_string(node) -> bool:
+    """Whether an expression builds a string at runtime rather than passing a literal."""
+    if isinstance(node, ast.JoinedStr):
+        return any(isinstance(value, ast.FormattedValue) for value in node.values)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        return True
+    return isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'format'
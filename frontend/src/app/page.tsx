@@ -2,17 +2,34 @@
 
 import React, { useState, FormEvent, useEffect, useRef } from 'react';
 
-type MessageType = 'status' | 'info' | 'error' | 'critical_error' | 'vulnerability' | 'done';
+type MessageType = 'status' | 'info' | 'error' | 'critical_error' | 'vulnerability' | 'finding' | 'triage' | 'done';
 
 interface ProgressMessage {
   id: number;
   type: MessageType;
-  payload: string | VulnerabilityPayload;
+  payload: string | VulnerabilityPayload | Finding | TriagePayload;
+}
+
+interface Finding {
+  file: string;
+  line: number | null;
+  cwe: string | null;
+  severity: 'High' | 'Medium' | 'Low';
+  description: string;
+  fix: string;
 }
 
 interface VulnerabilityPayload {
   file: string;
   analysis: string;
+  findings?: Finding[];
+}
+
+interface TriagePayload {
+  file: string;
+  score: number;
+  signals: Record<string, number>;
+  decision: 'analyze' | 'screen' | 'skip';
 }
 
 interface ErrorResponse {
@@ -24,7 +41,23 @@ interface ScanRequest {
   access_token?: string;
 }
 
+interface ScanJob {
+  scan_id: string;
+  status: string;
+}
+
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+const MAX_RECONNECT_ATTEMPTS = 10;
+const RECONNECT_DELAY_MS = 1000;
+
+async function throwIfNotOk(response: Response) {
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({ 
+      detail: `HTTP error! status: ${response.status}` 
+    })) as ErrorResponse;
+    throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+  }
+}
 
 export default function HomePage() {
   const [repoUrl, setRepoUrl] = useState('');
@@ -34,6 +67,7 @@ export default function HomePage() {
   const [error, setError] = useState<string | null>(null);
   const [isStreamFinished, setIsStreamFinished] = useState(false);
   const abortControllerRef = useRef<AbortController | null>(null);
+  const scanIdRef = useRef<string | null>(null);
 
   const handleSubmit = async (event: FormEvent<HTMLFormElement>) => {
     event.preventDefault();
@@ -51,7 +85,9 @@ export default function HomePage() {
         access_token: accessToken || undefined,
       };
 
-      const response = await fetch(`${API_URL}/scan_repository`, {
+      // The scan runs as a background job on the server; closing this page
+      // or losing the connection does not stop it.
+      const jobResponse = await fetch(`${API_URL}/scans`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -59,65 +95,108 @@ export default function HomePage() {
         body: JSON.stringify(requestBody),
         signal: abortControllerRef.current.signal,
       });
+      await throwIfNotOk(jobResponse);
+      const job = await jobResponse.json() as ScanJob;
+      scanIdRef.current = job.scan_id;
 
-      if (!response.ok) {
-        const errorData = await response.json().catch(() => ({ 
-          detail: `HTTP error! status: ${response.status}` 
-        })) as ErrorResponse;
-        throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
-      }
+      // Follow the job's event stream. When the connection drops before the
+      // scan has finished, reconnect with Last-Event-ID so the server
+      // replays only the events that were missed.
+      const signal = abortControllerRef.current.signal;
+      let lastEventId: string | null = null;
+      let finished = false;
+      let reconnectAttempts = 0;
 
-      if (!response.body) {
-        throw new Error('Response body is null.');
-      }
+      const handleEvent = (sseMessage: string, data: string) => {
+        try {
+          const parsedEvent = JSON.parse(data) as ProgressMessage;
+
+          setProgressMessages(prev => {
+            // A file's result replaces the findings streamed while it was being analyzed.
+            const kept = parsedEvent.type === 'vulnerability'
+              ? prev.filter(msg => !(msg.type === 'finding'
+                  && (msg.payload as Finding).file === (parsedEvent.payload as VulnerabilityPayload).file))
+              : prev;
+            return [...kept, {
+              id: messageIdCounter++,
+              type: parsedEvent.type,
+              payload: parsedEvent.payload
+            }];
+          });
 
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-      // SSE messages can be split across network chunks, so buffer partial
-      // data until a full "\n\n"-terminated message has arrived.
-      let buffer = '';
-
-      const processStream = async () => {
-        while (true) {
-          const { done, value } = await reader.read();
-          if (done) {
-            setIsStreamFinished(true);
-            break;
+          if (parsedEvent.type === 'done') {
+            finished = true;
           }
+          if (parsedEvent.type === 'critical_error') {
+            setError(`Backend Error: ${parsedEvent.payload}`);
+            finished = true;
+          }
+        } catch (e) {
+          console.error('Failed to parse SSE message:', sseMessage, e);
+        }
+      };
 
-          buffer += decoder.decode(value, { stream: true });
-          const parts = buffer.split('\n\n');
-          buffer = parts.pop() ?? '';
-          const sseMessages = parts.filter(msg => msg.trim() !== '');
-
-          sseMessages.forEach(sseMessage => {
-            if (sseMessage.startsWith('data:')) {
-              try {
-                const jsonData = sseMessage.substring(5).trim();
-                const parsedEvent = JSON.parse(jsonData) as ProgressMessage;
-                
-                setProgressMessages(prev => [...prev, { 
-                  id: messageIdCounter++, 
-                  type: parsedEvent.type,
-                  payload: parsedEvent.payload
-                }]);
-
-                if (parsedEvent.type === 'done') {
-                  setIsStreamFinished(true);
-                }
-                if (parsedEvent.type === 'critical_error') {
-                  setError(`Backend Error: ${parsedEvent.payload}`);
-                  setIsStreamFinished(true);
+      while (!finished) {
+        try {
+          const response = await fetch(`${API_URL}/scans/${job.scan_id}/events`, {
+            headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+            signal,
+          });
+          await throwIfNotOk(response);
+
+          if (!response.body) {
+            throw new Error('Response body is null.');
+          }
+
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          // SSE messages can be split across network chunks, so buffer partial
+          // data until a full "\n\n"-terminated message has arrived.
+          let buffer = '';
+
+          while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+              break;
+            }
+            reconnectAttempts = 0;
+
+            buffer += decoder.decode(value, { stream: true });
+            const parts = buffer.split('\n\n');
+            buffer = parts.pop() ?? '';
+
+            // Each message is a block of "field: value" lines; only id and data are used.
+            parts.forEach(sseMessage => {
+              let data = '';
+              sseMessage.split('\n').forEach(line => {
+                if (line.startsWith('id:')) {
+                  lastEventId = line.substring(3).trim();
+                } else if (line.startsWith('data:')) {
+                  data += line.substring(5).trim();
                 }
-              } catch (e) {
-                console.error('Failed to parse SSE message:', sseMessage, e);
+              });
+              if (data) {
+                handleEvent(sseMessage, data);
               }
-            }
-          });
-        }
-      };
+            });
+          }
 
-      await processStream();
+          // The server closes the stream once the job is over, which also
+          // covers jobs that were cancelled or interrupted without "done".
+          if (!finished) {
+            const statusResponse = await fetch(`${API_URL}/scans/${job.scan_id}`, { signal });
+            await throwIfNotOk(statusResponse);
+            const status = (await statusResponse.json() as ScanJob).status;
+            finished = status !== 'queued' && status !== 'running';
+          }
+        } catch (err) {
+          if ((err instanceof Error && err.name === 'AbortError') || ++reconnectAttempts > MAX_RECONNECT_ATTEMPTS) {
+            throw err;
+          }
+          await new Promise(resolve => setTimeout(resolve, RECONNECT_DELAY_MS * reconnectAttempts));
+        }
+      }
+      setIsStreamFinished(true);
 
     } catch (err) {
       if (err instanceof Error) {
@@ -135,6 +214,10 @@ export default function HomePage() {
   };
 
   const handleStop = () => {
+    if (scanIdRef.current) {
+      fetch(`${API_URL}/scans/${scanIdRef.current}/cancel`, { method: 'POST' }).catch(() => undefined);
+      scanIdRef.current = null;
+    }
     if (abortControllerRef.current) {
       abortControllerRef.current.abort();
       setIsLoading(false);
@@ -158,6 +241,26 @@ export default function HomePage() {
         </div>
       );
     }
+    if (message.type === 'finding') {
+      const finding = message.payload as Finding;
+      const location = finding.line ? ` line ${finding.line}` : '';
+      return (
+        <span>
+          Early finding in {finding.file}: [{finding.severity}]{location}{finding.cwe ? ` (${finding.cwe})` : ''}: {finding.description}
+        </span>
+      );
+    }
+    if (message.type === 'triage') {
+      const triage = message.payload as TriagePayload;
+      const signals = Object.keys(triage.signals).join(', ') || 'no risk signals';
+      return (
+        <span>
+          {triage.decision === 'skip' ? 'Skipped (low risk)'
+            : triage.decision === 'screen' ? 'Queued for screening (low risk)'
+            : 'Queued for analysis'}: {triage.file} (score {triage.score}; {signals})
+        </span>
+      );
+    }
     if (typeof message.payload === 'string') {
       return <span>{message.payload}</span>;
     }
@@ -239,7 +342,7 @@ export default function HomePage() {
               {progressMessages.map((msg) => (
                 <div key={msg.id} className={`p-4 rounded-xl text-sm ${
                   msg.type === 'error' || msg.type === 'critical_error' ? 'bg-[#FF3B30] bg-opacity-10 border border-[#FF3B30]' :
-                  msg.type === 'vulnerability' ? 'bg-[#FF9500] bg-opacity-10 border border-[#FF9500]' :
+                  msg.type === 'vulnerability' || msg.type === 'finding' ? 'bg-[#FF9500] bg-opacity-10 border border-[#FF9500]' :
                   msg.type === 'status' ? 'bg-[#007AFF] bg-opacity-10 border border-[#007AFF]' :
                   'bg-[#2c2c2e] border border-gray-700'
                 }`}